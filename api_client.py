@@ -36,7 +36,7 @@ def process_pdf(pdf_path, api_url="http://localhost:8000/process-pdf/"):
         # Process the response
         if response.status_code == 200:
             result = response.json()
-            print("Success! PDF processed and data sent to ASN API")
+            print(f"Success! {result.get('message', 'PDF processed')}")
             return result
         else:
             print(f"Error: API request failed with status code {response.status_code}")
@@ -55,17 +55,83 @@ def process_pdf(pdf_path, api_url="http://localhost:8000/process-pdf/"):
         print(f"Error: {str(e)}")
         return {"success": False, "message": str(e)}
 
+def process_pdf_stream(pdf_path, api_url="http://localhost:8000/process-pdf/stream"):
+    """
+    Send a PDF file to the streaming OCR API endpoint and print each page as it arrives
+    
+    Args:
+        pdf_path: Path to the PDF file
+        api_url: URL of the streaming API endpoint
+        
+    Returns:
+        dict: API response in the same shape as process_pdf
+    """
+    if not os.path.exists(pdf_path):
+        print(f"Error: File not found - {pdf_path}")
+        return {"success": False, "message": "File not found"}
+    
+    if not pdf_path.lower().endswith('.pdf'):
+        print("Error: Only PDF files are supported")
+        return {"success": False, "message": "Only PDF files are supported"}
+    
+    result = {"success": False, "filename": os.path.basename(pdf_path), "extracted_data": []}
+    try:
+        print(f"Sending {pdf_path} to OCR API server (streaming)...")
+        with open(pdf_path, "rb") as f:
+            files = {"file": (os.path.basename(pdf_path), f, "application/pdf")}
+            response = requests.post(api_url, files=files, stream=True)
+        
+        if response.status_code != 200:
+            print(f"Error: API request failed with status code {response.status_code}")
+            return {
+                "success": False,
+                "message": f"API request failed with status code {response.status_code}",
+                "details": response.text
+            }
+        
+        # Each line is one JSON event, handled as soon as it arrives
+        with response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                kind = event.pop("event", None)
+                if kind == "page":
+                    if "error" in event:
+                        print(f"  Page {event['page']}: Error - {event['error']}")
+                    else:
+                        print(f"  Page {event['page']}: Successfully extracted {event['type']} data")
+                    result["extracted_data"].append(event)
+                elif kind in ("asn", "error"):
+                    result.update(event)
+                    print(event.get("message", ""))
+        
+        result["extracted_data"].sort(key=lambda page: page["page"])
+        return result
+    
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return {**result, "success": False, "message": str(e)}
+
 def main():
     parser = argparse.ArgumentParser(description="Send PDF to OCR API Server")
     parser.add_argument("pdf_path", help="Path to the PDF file to process")
     parser.add_argument("--api-url", default="http://localhost:8000/process-pdf/", 
                       help="URL of the OCR API endpoint")
     parser.add_argument("--output", "-o", help="Path to save the output JSON file")
+    parser.add_argument("--stream", action="store_true",
+                      help="Use the streaming endpoint and show each page as soon as it is extracted")
     
     args = parser.parse_args()
     
     # Send the PDF to the API
-    result = process_pdf(args.pdf_path, args.api_url)
+    if args.stream:
+        api_url = args.api_url
+        if api_url.rstrip("/").endswith("/process-pdf"):
+            api_url = api_url.rstrip("/") + "/stream"
+        result = process_pdf_stream(args.pdf_path, api_url)
+    else:
+        result = process_pdf(args.pdf_path, args.api_url)
     
     # Save output if requested
     if args.output and result:
@@ -1,11 +1,18 @@
 import os
-import tempfile
+import asyncio
+import contextlib
+import functools
+import json
 import uvicorn
 import dotenv
 from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from concurrent.futures import ThreadPoolExecutor
 from app import InvoiceProcessor
+from jobs import JobManager, QueueFullError
+from uploads import UploadError, save_upload, validate_pdf, max_upload_bytes, MAX_UPLOAD_MB
+import metrics
 
 # Load environment variables
 dotenv.load_dotenv()
@@ -14,11 +21,38 @@ dotenv.load_dotenv()
 SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
 SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
 DEBUG_MODE = os.getenv("DEBUG_MODE", "True").lower() == "true"
+# Maximum number of PDFs processed at the same time by one server process
+API_MAX_CONCURRENT_JOBS = int(os.getenv("API_MAX_CONCURRENT_JOBS", "4"))
+
+# PDF processing is blocking (rasterization and model requests), so it runs on a
+# bounded thread pool and the event loop stays free to accept uploads and health checks
+job_executor = ThreadPoolExecutor(max_workers=API_MAX_CONCURRENT_JOBS, thread_name_prefix="process-pdf")
+
+# Shared processor - reuses the result cache and HTTP connection pools across requests
+processor = InvoiceProcessor()
+
+# Background job queue for large PDFs
+job_manager = JobManager(processor)
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Start background work in the serving process only"""
+    # `python api_server.py` also imports this module in the process that launches uvicorn (and its
+    # reloader), which must not pick up jobs or send from the outbox as well.
+    # Jobs left unfinished by a restart are picked up again.
+    job_manager.recover()
+    # Deliver anything left in the ASN outbox by an earlier run
+    if processor.outbox:
+        processor.outbox.start()
+    yield
+    if processor.outbox:
+        processor.outbox.stop()
 
 app = FastAPI(
     title="Invoice OCR API",
     description="API for extracting data from invoice PDFs and sending to ASN API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -30,32 +64,63 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Room for the multipart boundaries and headers around the PDF itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+@app.middleware("http")
+async def limit_upload_size(request, call_next):
+    """Reject uploads whose declared size is over the limit before the body is read"""
+    try:
+        content_length = int(request.headers.get("content-length", 0))
+    except ValueError:
+        content_length = 0
+    if request.method == "POST" and max_upload_bytes() and content_length > max_upload_bytes() + MULTIPART_OVERHEAD:
+        return JSONResponse(
+            status_code=413,
+            content={"success": False, "message": f"PDF is larger than the {MAX_UPLOAD_MB:g} MB upload limit"}
+        )
+    return await call_next(request)
+
+async def receive_pdf(file, directory=None):
+    """Stream an uploaded PDF to disk and check it before any work is queued, returning its path"""
+    # Raises UploadError, in which case nothing is left on disk
+    if not file.filename or not file.filename.lower().endswith('.pdf'):
+        raise UploadError("Only PDF files are supported")
+    pdf_path = await save_upload(file, directory)
+    try:
+        # pdfinfo runs on the default executor so it does not wait behind running jobs
+        await asyncio.get_running_loop().run_in_executor(None, validate_pdf, pdf_path, processor.get_page_count)
+    except BaseException:
+        os.unlink(pdf_path)
+        raise
+    return pdf_path
+
+def upload_error_response(error):
+    return JSONResponse(status_code=error.status_code, content={"success": False, "message": str(error)})
+
+def asn_success_message(api_response):
+    if api_response.get("queued"):
+        return "PDF processed and data queued for delivery to ASN API"
+    return "PDF processed and data sent to ASN API successfully"
+
 @app.post("/process-pdf/")
 async def process_pdf(file: UploadFile = File(...)):
     """
     Upload a PDF file to extract invoice/packing list data and send to ASN API.
     """
-    if not file.filename.lower().endswith('.pdf'):
-        return JSONResponse(
-            status_code=400,
-            content={"success": False, "message": "Only PDF files are supported"}
-        )
-    
-    # Create a processor instance
-    processor = InvoiceProcessor()
+    try:
+        temp_file_path = await receive_pdf(file)
+    except UploadError as e:
+        return upload_error_response(e)
     
     try:
-        # Save the uploaded file to a temporary location
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
-            temp_file_path = temp_file.name
-            contents = await file.read()
-            temp_file.write(contents)
-        
-        # Process the PDF
-        results, api_response = processor.process_pdf(temp_file_path, send_to_api=True)
-        
-        # Clean up the temporary file
-        os.unlink(temp_file_path)
+        # Process the PDF without blocking the event loop
+        loop = asyncio.get_running_loop()
+        timings = metrics.JobTimings()
+        results, api_response = await loop.run_in_executor(
+            job_executor,
+            functools.partial(processor.process_pdf, temp_file_path, send_to_api=True, timings=timings)
+        )
         
         # Check if ASN API call was successful
         if api_response and api_response.get("success"):
@@ -63,10 +128,11 @@ async def process_pdf(file: UploadFile = File(...)):
                 status_code=200,
                 content={
                     "success": True,
-                    "message": "PDF processed and data sent to ASN API successfully", 
+                    "message": asn_success_message(api_response), 
                     "filename": file.filename,
                     "extracted_data": results,
-                    "api_response": api_response
+                    "api_response": api_response,
+                    "timings": timings.summary()
                 }
             )
         else:
@@ -80,15 +146,12 @@ async def process_pdf(file: UploadFile = File(...)):
                     "success": False,
                     "message": f"Failed to send data to ASN API{error_detail}",
                     "filename": file.filename,
-                    "extracted_data": results
+                    "extracted_data": results,
+                    "timings": timings.summary()
                 }
             )
     
     except Exception as e:
-        # Clean up if an error occurs
-        if 'temp_file_path' in locals() and os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
-        
         return JSONResponse(
             status_code=500,
             content={
@@ -96,6 +159,144 @@ async def process_pdf(file: UploadFile = File(...)):
                 "message": f"Error processing PDF: {str(e)}"
             }
         )
+    finally:
+        # The upload is removed whether processing succeeded or not
+        if os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
+
+@app.post("/process-pdf/stream")
+async def process_pdf_stream(file: UploadFile = File(...)):
+    """
+    Upload a PDF file and stream each page's result as NDJSON as soon as it is extracted,
+    followed by the ASN API submission result.
+    """
+    try:
+        temp_file_path = await receive_pdf(file)
+    except UploadError as e:
+        return upload_error_response(e)
+    
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    
+    def on_page_result(page_number, result):
+        # Called from a worker thread as each page finishes
+        loop.call_soon_threadsafe(events.put_nowait, {"event": "page", "page": page_number, **result})
+    
+    timings = metrics.JobTimings()
+    future = loop.run_in_executor(
+        job_executor,
+        functools.partial(processor.process_pdf, temp_file_path, send_to_api=True,
+                          on_page_result=on_page_result, timings=timings)
+    )
+    
+    def remove_upload(_):
+        if os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
+    
+    # The upload is removed once processing stops reading it. A callback rather than cleanup in the
+    # generator, which a client disconnect cancels at every await and may never start at all.
+    future.add_done_callback(remove_upload)
+    
+    async def stream():
+        yield json.dumps({"event": "start", "filename": file.filename}) + "\n"
+        
+        # Forward page results until processing (including the ASN call) has finished
+        while not (future.done() and events.empty()):
+            getter = asyncio.ensure_future(events.get())
+            await asyncio.wait({getter, future}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield json.dumps(getter.result(), ensure_ascii=False) + "\n"
+            else:
+                getter.cancel()
+        
+        try:
+            results, api_response = future.result()
+        except Exception as e:
+            yield json.dumps({"event": "error", "success": False, "message": f"Error processing PDF: {str(e)}"}) + "\n"
+            return
+        
+        success = bool(api_response and api_response.get("success"))
+        yield json.dumps({
+            "event": "asn",
+            "success": success,
+            "message": asn_success_message(api_response) if success else "Failed to send data to ASN API",
+            "filename": file.filename,
+            # Grouped results cover several pages each
+            "page_count": sum(len(result.get("pages", [None])) for result in results),
+            "api_response": api_response,
+            "timings": timings.summary()
+        }, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/jobs/")
+async def submit_job(file: UploadFile = File(...)):
+    """
+    Upload a PDF file and process it in the background. Returns a job id right away.
+    """
+    try:
+        # Saved next to the queued PDFs, so handing it over to the job is a rename
+        upload_path = await receive_pdf(file, job_manager.pdf_dir)
+    except UploadError as e:
+        return upload_error_response(e)
+    
+    try:
+        job_id = job_manager.submit(file.filename, upload_path)
+    except QueueFullError as e:
+        return JSONResponse(
+            status_code=429,
+            content={"success": False, "message": str(e)},
+            headers={"Retry-After": "30"}
+        )
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"success": False, "message": f"Error queuing PDF: {str(e)}"}
+        )
+    
+    return JSONResponse(
+        status_code=202,
+        content={"success": True, "message": "PDF queued for processing", "job_id": job_id, "filename": file.filename}
+    )
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status and per-page progress of a background job"""
+    status = await asyncio.get_running_loop().run_in_executor(None, job_manager.status, job_id)
+    if not status:
+        return JSONResponse(status_code=404, content={"success": False, "message": "Job not found"})
+    return {"success": True, **status}
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(job_id: str):
+    """Page results of a background job - partial while it is running, final once it has completed"""
+    results = await asyncio.get_running_loop().run_in_executor(None, job_manager.results, job_id)
+    if not results:
+        return JSONResponse(status_code=404, content={"success": False, "message": "Job not found"})
+    return {"success": True, **results}
+
+@app.get("/asn-outbox/")
+async def get_asn_outbox():
+    """Number of ASN outbox entries per delivery status"""
+    if not processor.outbox:
+        return JSONResponse(status_code=404, content={"success": False, "message": "ASN outbox is disabled"})
+    stats = await asyncio.get_running_loop().run_in_executor(None, processor.outbox.stats)
+    return {"success": True, "entries": stats}
+
+@app.get("/asn-outbox/{outbox_id}")
+async def get_asn_outbox_entry(outbox_id: int):
+    """Delivery status of one ASN outbox entry"""
+    entry = None
+    if processor.outbox:
+        entry = await asyncio.get_running_loop().run_in_executor(None, processor.outbox.get, outbox_id)
+    if not entry:
+        return JSONResponse(status_code=404, content={"success": False, "message": "Outbox entry not found"})
+    return {"success": True, **entry}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Pipeline metrics in the Prometheus text format"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 async def root():
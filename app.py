@@ -1,13 +1,28 @@
 import os
+import sys
 import json
-import base64
-import requests
+import hashlib
+import glob
+import time
+import collections
 from PIL import Image
-import io
 import argparse
-from pdf2image import convert_from_path
+import contextlib
+import contextvars
+from pdf2image import convert_from_path, pdfinfo_from_path
 import tempfile
 import dotenv
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from image_preprocessing import ImagePreprocessor, PageImage, IMAGE_SOURCE_DPI, MODEL_MAX_EDGE, split_into_strips
+from result_cache import ResultCache, RESULT_CACHE_ENABLED, hash_file, hash_image, hash_text
+from asn_outbox import AsnOutbox, ASN_OUTBOX_ENABLED, FAILED
+import metrics
+from json_output import (STRUCTURED_OUTPUT, MAX_CONTINUATIONS, CONTINUE_PROMPT, SCHEMA_VERSION,
+                         response_format, parse_json_output, strip_continuation_fences, normalize_document,
+                         check_document, RERENDER_PROBLEMS)
+from page_classifier import PageClassifier, LOCAL_CLASSIFIER_ENABLED
+from text_layer import TEXT_LAYER_ENABLED, extract_page_texts, is_usable_text, compact_text
+from http_client import HttpClient, RateLimiter, MODEL_REQUESTS_PER_MINUTE, MODEL_TOKENS_PER_MINUTE, estimate_image_tokens
 
 # Load environment variables from .env file if it exists
 dotenv.load_dotenv()
@@ -22,231 +37,525 @@ API_KEY = os.getenv("API_KEY")
 ASN_API_URL = os.getenv("ASN_API_URL", "https://asn.mazedemo.in/api/method/asn_web.purchaseinvoiceandpacking.split_and_create_docs")
 ASN_API_TOKEN = os.getenv("ASN_API_TOKEN", "d8b9d365596cfa3:05844281d60f0e0")
 
-# Temp folder configuration
-TEMP_OUTPUT_FOLDER = os.getenv("TEMP_OUTPUT_FOLDER", tempfile.gettempdir())
+# Temp folder configuration - each job rasterizes into its own scratch directory
+# under this folder (e.g. a tmpfs mount such as /dev/shm) which is removed afterwards
+TEMP_OUTPUT_FOLDER = os.getenv("TEMP_OUTPUT_FOLDER") or tempfile.gettempdir()
+# Render pages straight into memory instead of going through the scratch directory
+RASTER_IN_MEMORY = os.getenv("RASTER_IN_MEMORY", "False").lower() == "true"
+
+# Concurrency configuration - maximum number of pages sent to the model at once
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "4"))
+
+# Rasterization configuration - number of pages rendered per pdf2image call
+RASTER_WINDOW = int(os.getenv("RASTER_WINDOW", "2"))
+
+# Adaptive rendering - pages are first rendered at DRAFT_DPI, and only rendered again at
+# IMAGE_SOURCE_DPI and re-extracted when the extracted data fails validation
+ADAPTIVE_DPI = os.getenv("ADAPTIVE_DPI", "True").lower() == "true"
+DRAFT_DPI = int(os.getenv("DRAFT_DPI", "150"))
+
+# Batch configuration - number of PDFs processed at the same time in batch mode
+BATCH_JOBS = int(os.getenv("BATCH_JOBS", "4"))
+
+# Extraction mode - classify and extract each page in a single request instead of
+# a separate classification call followed by an extraction call
+COMBINED_EXTRACTION = os.getenv("COMBINED_EXTRACTION", "True").lower() == "true"
+
+# Grouped extraction - runs of consecutive pages of the same type (such as an item table that
+# continues over several pages) are extracted in one request and returned as one document
+GROUPED_EXTRACTION = os.getenv("GROUPED_EXTRACTION", "False").lower() == "true"
+GROUP_MAX_PAGES = int(os.getenv("GROUP_MAX_PAGES", "4"))  # Pages sent in one request
+GROUP_MAX_TOKENS = int(os.getenv("GROUP_MAX_TOKENS", "8000"))  # Estimated page tokens sent in one request
+GROUP_MAX_OUTPUT_TOKENS = int(os.getenv("GROUP_MAX_OUTPUT_TOKENS", "16000"))
+
+# Prompts
+INVOICE_SYSTEM_PROMPT = "You are an AI specialized in extracting structured information from invoice images. Extract information in a structured JSON format without any explanations."
+INVOICE_FIELDS = "1. Vendor Name\n2. Address\n3. Invoice No.\n4. Invoice Name\n5. Date\n6. Table containing Order, Description, Quantity, Unit Price, Amount\n7. Total Quantity\n8. Total Amount"
+INVOICE_KEYS = "vendor_name, address, invoice_no, invoice_name, date, total_quantity, total_amount, and items (an array of objects with order, description, quantity, unit_price, amount)"
+INVOICE_PROMPT = f"Extract the following information from this invoice image and return it in a valid JSON format:\n\n{INVOICE_FIELDS}\n\nThe JSON should have keys: {INVOICE_KEYS}."
+
+PACKING_LIST_SYSTEM_PROMPT = "You are an AI specialized in extracting structured information from packing list images. Extract information in a structured JSON format without any explanations."
+PACKING_LIST_FIELDS = "1. Vendor Name\n2. Packing List No.\n3. Packet List Name\n4. Address\n5. Shipping Date\n6. Table containing No., Order, Description, Quantity, Net Weight, Gross Weight, Measurement\n7. Total Net Weight\n8. Total Gross Weight\n9. Total Measurement\n10. Final Item name"
+PACKING_LIST_KEYS = "vendor_name, packing_list_no, packing_list_name, address, shipping_date, total_net_weight, total_gross_weight, total_measurement, final_item_name, and items (an array of objects with no, order, description, quantity, net_weight, gross_weight, measurement)"
+PACKING_LIST_PROMPT = f"Extract the following information from this packing list image and return it in a valid JSON format:\n\n{PACKING_LIST_FIELDS}\nThe JSON should have keys: {PACKING_LIST_KEYS}."
+
+CLASSIFY_SYSTEM_PROMPT = "You are an AI specialized in document classification."
+CLASSIFY_PROMPT = "Determine if this document is an invoice or a packing list. Return only one word: either 'invoice' or 'packing_list'."
+
+COMBINED_SYSTEM_PROMPT = "You are an AI specialized in classifying invoice and packing list images and extracting structured information from them. Extract information in a structured JSON format without any explanations."
+COMBINED_PROMPT = (
+    "Determine if this document is an invoice or a packing list, then extract its information and return it in a valid JSON format "
+    "with exactly two keys: \"type\" (either \"invoice\" or \"packing_list\") and \"data\".\n\n"
+    f"If it is an invoice, extract:\n{INVOICE_FIELDS}\n\"data\" should have keys: {INVOICE_KEYS}.\n\n"
+    f"If it is a packing list, extract:\n{PACKING_LIST_FIELDS}\n\"data\" should have keys: {PACKING_LIST_KEYS}."
+)
+
+GROUP_PROMPT = (
+    "The {page_count} pages that follow are consecutive pages of the same document, in order, and its item table may continue "
+    "from one page to the next. Return a single JSON object for the whole document: take each field from whichever page shows it, "
+    "list every item row from all pages exactly once and in page order, and skip repeated table headers and carried-forward subtotals."
+)
+
+STRIPS_PROMPT = (
+    "The document is sent as {strip_count} overlapping horizontal strips cut from its {page_count} page(s), in reading order: "
+    "top to bottom, page by page. Neighbouring strips share a band of the page, so list every item row exactly once even if it "
+    "appears in two strips, and skip repeated table headers and carried-forward subtotals. Return a single JSON object for the whole document."
+)
+
+TEXT_LAYER_PROMPT = "The page is provided below as text extracted from the PDF's text layer instead of an image, with its column layout preserved:"
+
+# Prompt version - part of the result cache key, so editing any prompt invalidates cached results
+PROMPT_VERSION = hashlib.sha256("\n".join([
+    INVOICE_SYSTEM_PROMPT, INVOICE_PROMPT,
+    PACKING_LIST_SYSTEM_PROMPT, PACKING_LIST_PROMPT,
+    CLASSIFY_SYSTEM_PROMPT, CLASSIFY_PROMPT,
+    COMBINED_SYSTEM_PROMPT, COMBINED_PROMPT,
+    GROUP_PROMPT, STRIPS_PROMPT, TEXT_LAYER_PROMPT, CONTINUE_PROMPT,
+    SCHEMA_VERSION,
+]).encode("utf-8")).hexdigest()[:12]
+
+# Extraction prompts by document type
+EXTRACTION_PROMPTS = {
+    "invoice": (INVOICE_SYSTEM_PROMPT, INVOICE_PROMPT),
+    "packing_list": (PACKING_LIST_SYSTEM_PROMPT, PACKING_LIST_PROMPT),
+}
+
+# Shared HTTP clients - connection pools and the model rate limit are shared by every InvoiceProcessor
+MODEL_HTTP_CLIENT = HttpClient(rate_limiter=RateLimiter(MODEL_REQUESTS_PER_MINUTE, MODEL_TOKENS_PER_MINUTE))
+# Creating an ASN is not idempotent, so anything the server may have acted on is left to the outbox
+ASN_HTTP_CLIENT = HttpClient(idempotent=False)
 
 class InvoiceProcessor:
-    def __init__(self):
+    def __init__(self, max_workers=None, combined_extraction=None, raster_window=None,
+                 raster_in_memory=None, preprocessor=None, use_cache=None, cache=None,
+                 http_client=None, asn_http_client=None, use_text_layer=None, use_outbox=None,
+                 grouped_extraction=None, group_max_pages=None, group_max_tokens=None,
+                 use_local_classifier=None, classifier=None, adaptive_dpi=None):
         self.base_url = MODEL_BASE_URL
         self.api_version = API_VERSION
         self.model_name = MODEL_NAME
         self.api_key = API_KEY
+        self.max_workers = max(1, max_workers or MAX_CONCURRENT_REQUESTS)
+        # One page pool per processor, so concurrent documents share the same request limit
+        self.page_executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="page")
+        self.combined_extraction = COMBINED_EXTRACTION if combined_extraction is None else combined_extraction
+        self.grouped_extraction = GROUPED_EXTRACTION if grouped_extraction is None else grouped_extraction
+        self.group_max_pages = max(1, group_max_pages or GROUP_MAX_PAGES)
+        self.group_max_tokens = group_max_tokens or GROUP_MAX_TOKENS
+        self.raster_window = max(1, raster_window or RASTER_WINDOW)
+        self.raster_in_memory = RASTER_IN_MEMORY if raster_in_memory is None else raster_in_memory
+        self.preprocessor = preprocessor or ImagePreprocessor()
+        # Escalated pages are sent as strips at the full DPI, limited only by the size the model accepts
+        self.detail_preprocessor = ImagePreprocessor(
+            image_format=self.preprocessor.image_format, quality=self.preprocessor.quality,
+            target_dpi=IMAGE_SOURCE_DPI, max_edge=MODEL_MAX_EDGE,
+            grayscale=self.preprocessor.grayscale, crop_whitespace=False, measure_savings=False)
+        self.adaptive_dpi = ADAPTIVE_DPI if adaptive_dpi is None else adaptive_dpi
+        # Pages are rendered at the full DPI straight away when adaptive rendering is off
+        self.render_dpi = min(DRAFT_DPI, IMAGE_SOURCE_DPI) if self.adaptive_dpi else IMAGE_SOURCE_DPI
+        self.use_text_layer = TEXT_LAYER_ENABLED if use_text_layer is None else use_text_layer
+        self.structured_output = STRUCTURED_OUTPUT
+        if use_local_classifier is None:
+            use_local_classifier = LOCAL_CLASSIFIER_ENABLED
+        self.classifier = (classifier or PageClassifier()) if use_local_classifier else None
+        self.http_client = http_client or MODEL_HTTP_CLIENT
+        self.asn_http_client = asn_http_client or ASN_HTTP_CLIENT
+        if use_outbox is None:
+            use_outbox = ASN_OUTBOX_ENABLED
+        self.outbox = AsnOutbox(self._post_to_asn) if use_outbox else None
+        if use_cache is None:
+            use_cache = RESULT_CACHE_ENABLED
+        self.cache = (cache or ResultCache()) if use_cache else None
+    
+    @property
+    def cache_namespace(self):
+        """Everything besides the content that determines an extraction result"""
+        # The document key is only the PDF hash, so every setting that changes what the model sees
+        # or how it is asked belongs here. Grouped mode returns one result per document instead of one per page.
+        prep = self.preprocessor
+        mode = "|".join([
+            f"grouped-{self.group_max_pages}p-{self.group_max_tokens}t" if self.grouped_extraction else "pages",
+            "combined" if self.combined_extraction else "two-step",
+            # Pages the local classifier decides get the single-type prompt instead of the combined one
+            "local-classifier" if self.classifier else "model-classifier",
+            f"{MAX_CONTINUATIONS}-continuations",
+            "text-layer" if self.use_text_layer else "images",
+            "structured" if self.structured_output else "json",
+            f"{self.render_dpi}dpi" + ("-adaptive" if self.adaptive_dpi else ""),
+            f"{prep.image_format}-q{prep.quality}-{prep.target_dpi}dpi-{prep.max_edge}px-{prep.classify_max_edge}px"
+            + ("-gray" if prep.grayscale else "") + ("-crop" if prep.crop_whitespace else ""),
+        ])
+        return f"{self.model_name}|{PROMPT_VERSION}|{self.api_version}|{mode}"
         
-    def pdf_to_images(self, pdf_path):
-        """Convert PDF to list of PIL Images using pdf2image"""
+    def get_page_count(self, pdf_path):
+        """Return the number of pages in a PDF using pdfinfo"""
+        return int(pdfinfo_from_path(pdf_path)["Pages"])
+    
+    def _scratch_dir(self):
+        """Per-job scratch directory for rasterized pages, or None to render in memory"""
+        if self.raster_in_memory:
+            return contextlib.nullcontext(None)
+        os.makedirs(TEMP_OUTPUT_FOLDER, exist_ok=True)
+        return tempfile.TemporaryDirectory(dir=TEMP_OUTPUT_FOLDER, prefix="invoice_raster_")
+    
+    def _render_pages(self, pdf_path, first_page, last_page, output_folder, dpi=None):
+        """Render a range of pages and return them fully loaded in memory"""
+        with metrics.timed("rasterize"):
+            return self._load_rendered_pages(pdf_path, first_page, last_page, output_folder, dpi or self.render_dpi)
+    
+    def _load_rendered_pages(self, pdf_path, first_page, last_page, output_folder, dpi):
+        images = convert_from_path(
+            pdf_path,
+            dpi=dpi,
+            first_page=first_page,
+            last_page=last_page,
+            output_folder=output_folder,
+            fmt="png",
+            use_pdftocairo=True,
+            single_file=False
+        )
+        
+        # Images backed by files in the scratch directory are opened lazily, so load
+        # them now and remove the files instead of letting them accumulate on disk
+        for image in images:
+            filename = getattr(image, "filename", None)
+            image.load()
+            if output_folder and filename and os.path.exists(filename):
+                os.remove(filename)
+        return images
+    
+    def _page_texts(self, pdf_path, first_page, last_page):
+        """Usable text layer of each page in a range, or None for pages that need an image"""
         try:
-            # Create a temporary directory for pdf2image
-            with tempfile.TemporaryDirectory() as path:
-                # Convert PDF to a list of images
-                images = convert_from_path(
-                    pdf_path,
-                    dpi=300,  # Higher DPI for better quality
-                    output_folder=TEMP_OUTPUT_FOLDER,
-                    fmt="png",
-                    use_pdftocairo=True,
-                    single_file=False
-                )
-                return images
+            with metrics.timed("text_layer"):
+                texts = extract_page_texts(pdf_path, first_page, last_page)
         except Exception as e:
-            print(f"Error converting PDF to images: {e}")
-            return []
+            print(f"Error reading text layer of pages {first_page}-{last_page}: {e}")
+            return [None] * (last_page - first_page + 1)
+        return [compact_text(text) if is_usable_text(text) else None for text in texts]
+    
+    def iter_pdf_pages(self, pdf_path, use_text_layer=False, dpi=None):
+        """Yield (page_number, PIL Image, text) for each page, handling a small window of pages at a time"""
+        # Pages are rendered at dpi, by default the processor's render_dpi
+        # With use_text_layer, pages with a usable text layer are yielded with their text and
+        # no image, and only the remaining pages are rasterized. Raises RuntimeError if the PDF
+        # cannot be read or a page cannot be rendered, so a document is never silently truncated.
+        try:
+            page_count = self.get_page_count(pdf_path)
+        except Exception as e:
+            raise RuntimeError(f"Could not read PDF page count: {e}") from e
+        
+        # The scratch directory is removed when the generator finishes or is closed early
+        with self._scratch_dir() as output_folder:
+            for first_page in range(1, page_count + 1, self.raster_window):
+                last_page = min(first_page + self.raster_window - 1, page_count)
+                page_numbers = range(first_page, last_page + 1)
+                if use_text_layer:
+                    texts = dict(zip(page_numbers, self._page_texts(pdf_path, first_page, last_page)))
+                else:
+                    texts = dict.fromkeys(page_numbers)
+                
+                # Convert only the pages of this window that have no usable text, in contiguous runs
+                images = {}
+                missing = [page_number for page_number in page_numbers if texts[page_number] is None]
+                while missing:
+                    run_end = missing[0]
+                    while run_end + 1 in missing:
+                        run_end += 1
+                    try:
+                        rendered = self._render_pages(pdf_path, missing[0], run_end, output_folder, dpi)
+                    except Exception as e:
+                        raise RuntimeError(f"Could not convert pages {missing[0]}-{run_end} to images: {e}") from e
+                    images.update(zip(range(missing[0], run_end + 1), rendered))
+                    del rendered
+                    missing = [page_number for page_number in missing if page_number > run_end]
+                
+                # Hand pages over one by one so each can be freed as soon as it is processed
+                for page_number in page_numbers:
+                    yield page_number, images.pop(page_number, None), texts[page_number]
+    
+    def pdf_to_images(self, pdf_path):
+        """Convert PDF to list of PIL Images using pdf2image"""
+        # Plain images carry no DPI, and the preprocessor assumes they were rendered at IMAGE_SOURCE_DPI
+        return [image for _, image, _ in self.iter_pdf_pages(pdf_path, dpi=IMAGE_SOURCE_DPI)]
     
-    def encode_image(self, image):
-        """Encode PIL Image to base64"""
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode('utf-8')
+    def as_page(self, image, page_number=None, text=None):
+        """Wrap a PIL Image or page text in a PageImage so it is encoded only once"""
+        if isinstance(image, PageImage):
+            return image
+        return PageImage(image, page_number, self.preprocessor, text=text)
     
-    def analyze_invoice_image(self, image):
-        """Analyze invoice image using Azure OpenAI"""
+    def encode_image(self, image, purpose="extract"):
+        """Return the base64 data URL of a page, encoding it on first use"""
+        page = self.as_page(image)
+        if page.is_encoded(purpose):
+            return page.data_url(purpose)
+        with metrics.timed("encode"):
+            data_url = page.data_url(purpose)
+        stats = page.stats(purpose)
+        metrics.record_image_bytes(purpose, stats['encoded_bytes'], stats.get('bytes_saved'))
+        saved = (f" ({stats['bytes_saved']} bytes or {stats['bytes_saved'] / stats['baseline_bytes']:.0%} saved "
+                 f"against a PNG of the rendered page)" if 'bytes_saved' in stats else "")
+        print(f"Page {page.page_number}: encoded {purpose} image {stats['original_size'][0]}x{stats['original_size'][1]} -> "
+              f"{stats['encoded_size'][0]}x{stats['encoded_size'][1]} {stats['format']}: {stats['encoded_bytes']} bytes{saved}")
+        return data_url
+    
+    def _chat_completion(self, system_prompt, user_prompt, image, max_tokens, purpose="extract",
+                         output_format=None, partial_output=None):
+        """Send a chat completion request for one page, or a list of pages, to Azure OpenAI"""
+        # output_format is sent as response_format. With partial_output, the model is asked to
+        # continue a reply that was cut off instead of answering from scratch.
         headers = {
             "api-key": self.api_key,
             "Content-Type": "application/json"
         }
         
-        # Convert image to base64
-        base64_image = self.encode_image(image)
+        pages = [self.as_page(page) for page in image] if isinstance(image, list) else [self.as_page(image)]
+        content = [
+            {
+                "type": "text",
+                "text": user_prompt
+            }
+        ]
+        image_tokens = 0
+        for page in pages:
+            if page.text is not None:
+                # Pages with a text layer are sent as text, which is much smaller than an image
+                content.append({
+                    "type": "text",
+                    "text": f"{TEXT_LAYER_PROMPT}\n\n{page.text}"
+                })
+            else:
+                # Convert image to a base64 data URL
+                content.append({
+                    "type": "image_url",
+                    "image_url": {
+                        "url": self.encode_image(page, purpose)
+                    }
+                })
+                image_tokens += estimate_image_tokens(*page.stats(purpose)["encoded_size"])
         
         # Create payload for the API request
         payload = {
             "messages": [
                 {
                     "role": "system", 
-                    "content": "You are an AI specialized in extracting structured information from invoice images. Extract information in a structured JSON format without any explanations."
+                    "content": system_prompt
                 },
                 {
                     "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Extract the following information from this invoice image and return it in a valid JSON format:\n\n1. Vendor Name\n2. Address\n3. Invoice No.\n4. Invoice Name\n5. Date\n6. Table containing Order, Description, Quantity, Unit Price, Amount\n7. Total Quantity\n8. Total Amount\n\nThe JSON should have keys: vendor_name, address, invoice_no, invoice_name, date, total_quantity, total_amount, and items (an array of objects with order, description, quantity, unit_price, amount)."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
-                            }
-                        }
-                    ]
+                    "content": content
                 }
             ],
             "model": self.model_name,
-            "max_tokens": 4000
+            "max_tokens": max_tokens
         }
+        if partial_output is not None:
+            # A continuation is a fragment of JSON, so it cannot follow the schema itself
+            payload["messages"] += [
+                {"role": "assistant", "content": partial_output},
+                {"role": "user", "content": CONTINUE_PROMPT}
+            ]
+        elif output_format:
+            payload["response_format"] = output_format
         
         # Make the API request
         api_endpoint = f"{self.base_url}openai/deployments/{self.model_name}/chat/completions?api-version={self.api_version}"
-        response = requests.post(api_endpoint, headers=headers, json=payload)
-        
+        # Rough token cost of the request, used by the client-side rate limiter
+        text_length = len(system_prompt) + sum(len(part.get("text", "")) for part in content)
+        tokens = max_tokens + text_length // 4 + image_tokens
+        with metrics.timed(purpose):
+            response = self.http_client.post(api_endpoint, tokens=tokens, headers=headers, json=payload)
+        metrics.record_retries("model", getattr(response, "retry_count", 0))
         if response.status_code == 200:
-            result = response.json()
             try:
-                # Extract JSON from the response content
-                json_str = result["choices"][0]["message"]["content"]
-                # Try to parse the JSON response
-                extracted_data = json.loads(json_str)
-                return {"type": "invoice", "data": extracted_data}
-            except (json.JSONDecodeError, KeyError) as e:
-                return {"error": f"Failed to parse JSON response: {str(e)}", "raw_response": result}
-        else:
-            return {"error": f"API request failed with status code {response.status_code}", "details": response.text}
+                metrics.record_usage(response.json().get("usage"))
+            except ValueError:
+                pass
+        return response
     
-    def analyze_packing_list_image(self, image):
-        """Analyze packing list image using Azure OpenAI"""
-        headers = {
-            "api-key": self.api_key,
-            "Content-Type": "application/json"
-        }
+    def _extract(self, doc_type, system_prompt, user_prompt, image, max_tokens=4000):
+        """Run an extraction prompt and wrap the parsed JSON as a page result"""
+        # doc_type None means the combined prompt, whose JSON holds the type and the data
+        output_format = response_format(doc_type) if self.structured_output else None
+        response = self._chat_completion(system_prompt, user_prompt, image, max_tokens=max_tokens,
+                                         output_format=output_format)
+        if response.status_code == 400 and output_format and "response_format" in response.text:
+            # Older API versions and deployments do not support structured outputs
+            print("Structured outputs are not supported by this deployment, falling back to plain JSON prompts")
+            self.structured_output = False
+            response = self._chat_completion(system_prompt, user_prompt, image, max_tokens=max_tokens)
+        if response.status_code != 200:
+            return {"error": f"API request failed with status code {response.status_code}", "details": response.text}
         
-        # Convert image to base64
-        base64_image = self.encode_image(image)
+        result = response.json()
+        try:
+            choice = result["choices"][0]
+            content = choice["message"]["content"] or ""
+            finish_reason = choice.get("finish_reason")
+        except (KeyError, IndexError, TypeError) as e:
+            return {"error": f"Failed to parse JSON response: {str(e)}", "raw_response": result}
         
-        # Create payload for the API request
-        payload = {
-            "messages": [
-                {
-                    "role": "system", 
-                    "content": "You are an AI specialized in extracting structured information from packing list images. Extract information in a structured JSON format without any explanations."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Extract the following information from this packing list image and return it in a valid JSON format:\n\n1. Vendor Name\n2. Packing List No.\n3. Packet List Name\n4. Address\n5. Shipping Date\n6. Table containing No., Order, Description, Quantity, Net Weight, Gross Weight, Measurement\n7. Total Net Weight\n8. Total Gross Weight\n9. Total Measurement\n10. Final Item name\nThe JSON should have keys: vendor_name, packing_list_no, packing_list_name, address, shipping_date, total_net_weight, total_gross_weight, total_measurement, final_item_name, and items (an array of objects with no, order, description, quantity, net_weight, gross_weight, measurement)."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            "model": self.model_name,
-            "max_tokens": 4000
-        }
+        # A reply cut off by max_tokens is continued rather than requested again from scratch
+        continuations = 0
+        while finish_reason == "length" and continuations < MAX_CONTINUATIONS:
+            continuations += 1
+            print(f"Response was cut off after {len(content)} characters, requesting continuation {continuations}")
+            metrics.record_output_fix("continuation")
+            response = self._chat_completion(system_prompt, user_prompt, image, max_tokens=max_tokens,
+                                             partial_output=content)
+            if response.status_code != 200:
+                break
+            try:
+                choice = response.json()["choices"][0]
+                content += strip_continuation_fences(choice["message"]["content"])
+                finish_reason = choice.get("finish_reason")
+            except (ValueError, KeyError, IndexError, TypeError):
+                break
         
-        # Make the API request
-        api_endpoint = f"{self.base_url}openai/deployments/{self.model_name}/chat/completions?api-version={self.api_version}"
-        response = requests.post(api_endpoint, headers=headers, json=payload)
+        try:
+            # Fences and output that is still truncated are repaired locally
+            extracted_data, repairs = parse_json_output(content)
+        except json.JSONDecodeError as e:
+            return {"error": f"Failed to parse JSON response: {str(e)}", "raw_response": result}
+        for repair in repairs:
+            print(f"Repaired model output: {repair}")
+            metrics.record_output_fix(repair)
+        result = {"type": doc_type, "data": normalize_document(doc_type, extracted_data)}
+        if "truncated" in repairs:
+            # Kept rather than failed, but flagged and never cached so the page is extracted again next time
+            result["warnings"] = ["Model output was cut off; trailing table rows may be missing"]
+        return result
+    
+    def analyze_invoice_image(self, image):
+        """Analyze invoice image using Azure OpenAI"""
+        return self._extract("invoice", INVOICE_SYSTEM_PROMPT, INVOICE_PROMPT, image)
+    
+    def analyze_packing_list_image(self, image):
+        """Analyze packing list image using Azure OpenAI"""
+        return self._extract("packing_list", PACKING_LIST_SYSTEM_PROMPT, PACKING_LIST_PROMPT, image)
+    
+    def analyze_document_image(self, image):
+        """Classify and extract an invoice or packing list image in a single request"""
+        result = self._extract(None, COMBINED_SYSTEM_PROMPT, COMBINED_PROMPT, image)
+        if "error" in result:
+            return result
         
-        if response.status_code == 200:
-            result = response.json()
+        # The combined prompt returns {"type": ..., "data": ...}
+        document = result["data"]
+        doc_type = document.get("type") if isinstance(document, dict) else None
+        if doc_type not in ("invoice", "packing_list") or not isinstance(document.get("data"), dict):
+            return {"error": f"Unexpected combined extraction response: document type {doc_type!r}", "raw_response": document}
+        return {"type": doc_type, "data": document["data"], **({"warnings": result["warnings"]} if "warnings" in result else {})}
+    
+    def analyze_document_group(self, doc_type, pages):
+        """Extract consecutive pages of one invoice or packing list in a single request"""
+        system_prompt, user_prompt = EXTRACTION_PROMPTS[doc_type]
+        if len(pages) > 1:
+            user_prompt = f"{user_prompt}\n\n{GROUP_PROMPT.format(page_count=len(pages))}"
+        max_tokens = min(GROUP_MAX_OUTPUT_TOKENS, 4000 * len(pages))
+        result = self._extract(doc_type, system_prompt, user_prompt, pages, max_tokens=max_tokens)
+        if "error" not in result and not isinstance(result["data"], dict):
+            return {"error": "Unexpected grouped extraction response: expected a JSON object", "raw_response": result["data"]}
+        return result
+    
+    def analyze_document_strips(self, doc_type, pages):
+        """Extract pages of one document from overlapping strips, so the model sees more detail than a whole page allows"""
+        system_prompt, user_prompt = EXTRACTION_PROMPTS[doc_type]
+        strips = []
+        for page in pages:
+            # Margins are cropped before splitting, so the strips spend their width on content
+            image = self.preprocessor.crop_to_content(page.image) if self.preprocessor.crop_whitespace else page.image
+            strips += [PageImage(strip, page.page_number, self.detail_preprocessor, dpi=page.dpi)
+                       for strip in split_into_strips(image)]
+        user_prompt = f"{user_prompt}\n\n{STRIPS_PROMPT.format(strip_count=len(strips), page_count=len(pages))}"
+        max_tokens = min(GROUP_MAX_OUTPUT_TOKENS, 4000 * len(pages))
+        try:
+            result = self._extract(doc_type, system_prompt, user_prompt, strips, max_tokens=max_tokens)
+        finally:
+            for strip in strips:
+                strip.release()
+        if "error" not in result and not isinstance(result["data"], dict):
+            return {"error": "Unexpected strip extraction response: expected a JSON object", "raw_response": result["data"]}
+        return result
+    
+    def classify_locally(self, image):
+        """Document type from the local classifier, or None if it is not confident"""
+        if not self.classifier:
+            return None
+        page = self.as_page(image)
+        with metrics.timed("local_classify"):
+            doc_type, confidence, source = self.classifier.classify(page.text, page.image)
+        if doc_type:
+            print(f"Page {page.page_number}: classified locally as {doc_type} ({source}, confidence {confidence:.2f})")
+            metrics.record_classification(source)
+        return doc_type
+    
+    def learn_document_type(self, image, doc_type):
+        """Remember the template of a page whose type the model has determined"""
+        page = self.as_page(image)
+        if self.classifier and page.image is not None and doc_type in EXTRACTION_PROMPTS:
             try:
-                # Extract JSON from the response content
-                json_str = result["choices"][0]["message"]["content"]
-                # Try to parse the JSON response
-                extracted_data = json.loads(json_str)
-                return {"type": "packing_list", "data": extracted_data}
-            except (json.JSONDecodeError, KeyError) as e:
-                return {"error": f"Failed to parse JSON response: {str(e)}", "raw_response": result}
-        else:
-            return {"error": f"API request failed with status code {response.status_code}", "details": response.text}
+                self.classifier.learn(page.image, doc_type)
+            except Exception as e:
+                print(f"Page {page.page_number}: error updating the page classifier: {str(e)}")
     
     def detect_document_type(self, image):
         """Detect if the image is an invoice or a packing list"""
-        headers = {
-            "api-key": self.api_key,
-            "Content-Type": "application/json"
-        }
-        
-        # Convert image to base64
-        base64_image = self.encode_image(image)
-        
-        # Create payload for the API request
-        payload = {
-            "messages": [
-                {
-                    "role": "system", 
-                    "content": "You are an AI specialized in document classification."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Determine if this document is an invoice or a packing list. Return only one word: either 'invoice' or 'packing_list'."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            "model": self.model_name,
-            "max_tokens": 50
-        }
+        # The model is only asked when the local classifier is not confident
+        doc_type = self.classify_locally(image)
+        if doc_type:
+            return doc_type
         
-        # Make the API request
-        api_endpoint = f"{self.base_url}openai/deployments/{self.model_name}/chat/completions?api-version={self.api_version}"
-        response = requests.post(api_endpoint, headers=headers, json=payload)
+        # Classification only needs a small thumbnail of the page
+        response = self._chat_completion(CLASSIFY_SYSTEM_PROMPT, CLASSIFY_PROMPT, image, max_tokens=50, purpose="classify")
         
         if response.status_code == 200:
             result = response.json()
             doc_type = result["choices"][0]["message"]["content"].strip().lower()
+            metrics.record_classification("model")
             
             if doc_type == "invoice":
+                self.learn_document_type(image, doc_type)
                 return "invoice"
             elif doc_type == "packing_list":
+                self.learn_document_type(image, doc_type)
                 return "packing_list"
             else:
                 return "unknown"
         else:
             return "unknown"
     
-    def send_to_asn_api(self, results):
-        """Send extracted data to ASN API endpoint"""
-        api_url = ASN_API_URL
+    def _post_to_asn(self, payload, idempotency_key=None):
+        """POST a list of results to the ASN API and return (success, details)"""
         headers = {
             "Authorization": f"Token {ASN_API_TOKEN}",
             "Content-Type": "application/json"
         }
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
         
+        with metrics.timed("asn_send"):
+            response = self.asn_http_client.post(ASN_API_URL, headers=headers, json=payload)
+        metrics.record_retries("asn", getattr(response, "retry_count", 0))
+        if response.status_code in [200, 201]:
+            return True, {"response": response.json()}
+        return False, {"status_code": response.status_code, "details": response.text}
+    
+    def send_to_asn_api(self, results):
+        """Send extracted data to ASN API endpoint"""
         try:
             # Filter out results with errors
             valid_results = [result for result in results if 'error' not in result]
             
             # Make the API request
-            response = requests.post(api_url, headers=headers, json=valid_results)
+            success, details = self._post_to_asn(valid_results)
             
-            if response.status_code in [200, 201]:
+            if success:
                 print("Successfully sent data to ASN API")
-                return {
-                    "success": True,
-                    "response": response.json()
-                }
             else:
-                print(f"Failed to send data to ASN API. Status code: {response.status_code}")
-                return {
-                    "success": False,
-                    "status_code": response.status_code,
-                    "details": response.text
-                }
+                print(f"Failed to send data to ASN API. Status code: {details['status_code']}")
+            return {"success": success, **details}
         except Exception as e:
             print(f"Error sending data to ASN API: {str(e)}")
             return {
@@ -254,33 +563,364 @@ class InvoiceProcessor:
                 "error": str(e)
             }
     
-    def process_pdf(self, pdf_path, output_path=None, send_to_api=True):
-        """Process PDF and extract information"""
-        # Convert PDF to images
-        images = self.pdf_to_images(pdf_path)
-        results = []
+    def queue_for_asn_api(self, results):
+        """Store extracted data in the outbox for background delivery to the ASN API"""
+        valid_results = [result for result in results if 'error' not in result]
+        if not valid_results:
+            print("No valid results to send to ASN API")
+            return {"success": False, "error": "No valid results to send"}
         
-        for i, image in enumerate(images):
-            print(f"Processing page {i+1}/{len(images)}...")
-            
-            # Detect document type
-            doc_type = self.detect_document_type(image)
-            print(f"Detected document type: {doc_type}")
-            
-            # Process based on document type
+        try:
+            entry = self.outbox.enqueue(valid_results)
+        except Exception as e:
+            print(f"Error queuing data for ASN API: {str(e)}")
+            return {"success": False, "error": str(e)}
+        if entry.get('conflict'):
+            print(f"Data for ASN API differs from what was already sent under the same numbers (outbox entry {entry['outbox_id']})")
+            return {"success": False, "queued": False, "error": "A different document with the same numbers was already sent", **entry}
+        if entry['status'] == FAILED:
+            print(f"Data for ASN API was given up on (outbox entry {entry['outbox_id']})")
+            return {"success": False, "queued": True, "error": "Outbox entry has failed", **entry}
+        print(f"Queued data for ASN API (outbox entry {entry['outbox_id']}, {entry['status']})")
+        return {"success": True, "queued": True, **entry}
+    
+    def _extract_page(self, page):
+        """Classify and extract a single page with the model"""
+        page_number = page.page_number
+        if self.combined_extraction:
+            # A page the local classifier is sure about gets the shorter single-type prompt
+            doc_type = self.classify_locally(page)
             if doc_type == "invoice":
-                result = self.analyze_invoice_image(image)
+                return self.analyze_invoice_image(page)
             elif doc_type == "packing_list":
-                result = self.analyze_packing_list_image(image)
-            else:
-                # If unknown, try both
-                invoice_result = self.analyze_invoice_image(image)
-                if "error" not in invoice_result:
-                    result = invoice_result
-                else:
-                    result = self.analyze_packing_list_image(image)
+                return self.analyze_packing_list_image(page)
+            
+            # Classify and extract in a single request
+            result = self.analyze_document_image(page)
+            print(f"Page {page_number}: detected document type: {result.get('type', 'unknown')}")
+            if "error" not in result:
+                metrics.record_classification("model")
+                self.learn_document_type(page, result["type"])
+            return result
+        
+        # Detect document type
+        doc_type = self.detect_document_type(page)
+        print(f"Page {page_number}: detected document type: {doc_type}")
+        
+        # Process based on document type
+        if doc_type == "invoice":
+            return self.analyze_invoice_image(page)
+        elif doc_type == "packing_list":
+            return self.analyze_packing_list_image(page)
+        
+        # If unknown, try both
+        invoice_result = self.analyze_invoice_image(page)
+        if "error" not in invoice_result:
+            return invoice_result
+        return self.analyze_packing_list_image(page)
+    
+    def _validation_problems(self, pages, result, label):
+        """Problems with a result that rendering its pages at a higher DPI may fix, or [] if there are none"""
+        # Only successful extractions of pages rendered below the full DPI are checked
+        if not self.adaptive_dpi or "error" in result:
+            return []
+        if any(page.text is not None or not page.source or (page.dpi or IMAGE_SOURCE_DPI) >= IMAGE_SOURCE_DPI
+               for page in pages):
+            return []
+        problems = check_document(result.get("type"), result.get("data"))
+        for kind, message in problems:
+            if kind not in RERENDER_PROBLEMS:
+                print(f"{label}: {message}, kept as extracted")
+        return [problem for problem in problems if problem[0] in RERENDER_PROBLEMS]
+    
+    def _render_full_dpi(self, pages):
+        """Render pages of a PDF again at the full DPI"""
+        with self._scratch_dir() as output_folder:
+            images = self._render_pages(pages[0].source, pages[0].page_number, pages[-1].page_number,
+                                        output_folder, dpi=IMAGE_SOURCE_DPI)
+        by_number = dict(zip(range(pages[0].page_number, pages[-1].page_number + 1), images))
+        return [PageImage(by_number[page.page_number], page.page_number, self.preprocessor,
+                          dpi=IMAGE_SOURCE_DPI, source=page.source) for page in pages]
+    
+    def _escalate(self, pages, result, problems, label):
+        """Extract pages again from strips at the full DPI after their draft result failed validation"""
+        # The document type is kept, so only the extraction request is repeated. A whole page reaches
+        # the model at the same size at any DPI, so the sharper rendering is sent in strips.
+        reason, message = problems[0]
+        print(f"{label}: {message}, extracting again from strips at {IMAGE_SOURCE_DPI} DPI")
+        sharper = []
+        try:
+            sharper = self._render_full_dpi(pages)
+            escalated = self.analyze_document_strips(result["type"], sharper)
+        except Exception as e:
+            escalated = {"error": str(e)}
+        finally:
+            for page in sharper:
+                page.release()
+        if "error" in escalated:
+            print(f"{label}: extraction at {IMAGE_SOURCE_DPI} DPI failed ({escalated['error']}), keeping the draft result")
+            metrics.record_escalation(reason, False, len(pages))
+            return result
+        remaining = [problem for problem in check_document(escalated["type"], escalated["data"])
+                     if problem[0] in RERENDER_PROBLEMS]
+        if remaining:
+            print(f"{label}: {remaining[0][1]} at {IMAGE_SOURCE_DPI} DPI as well")
+        metrics.record_escalation(reason, not remaining, len(pages))
+        return escalated
+    
+    def process_page(self, page, page_number=None):
+        """Detect the document type of a single page and extract its data"""
+        # The page is encoded once and the same data URL is reused by every request below
+        page = self.as_page(page, page_number)
+        page_number = page.page_number
+        try:
+            # Identical pages are answered from the cache without calling the model
+            cache_key = None
+            if self.cache:
+                content_hash = hash_text(page.text) if page.text is not None else hash_image(page.image)
+                cache_key = self.cache.make_key(content_hash, self.cache_namespace)
+                cached = self.cache.get_page(cache_key)
+                metrics.record_cache_lookup("page", cached is not None)
+                if cached is not None:
+                    print(f"Page {page_number}: using cached {cached.get('type', 'unknown')} result")
+                    metrics.record_page(True)
+                    return cached
+            
+            with metrics.timed("page"):
+                result = self._extract_page(page)
+                problems = self._validation_problems([page], result, f"Page {page_number}")
+                if problems:
+                    result = self._escalate([page], result, problems, f"Page {page_number}")
+            if cache_key and "error" not in result and "warnings" not in result:
+                self.cache.set_page(cache_key, result)
+            metrics.record_page("error" not in result)
+            return result
+        except Exception as e:
+            # A failing page must not stop the rest of the document
+            print(f"Page {page_number}: error processing page: {str(e)}")
+            metrics.record_page(False)
+            return {"error": f"Failed to process page: {str(e)}"}
+        finally:
+            page.release()
+    
+    def _process_reported_page(self, page, on_page_result):
+        """Process a page and report its result, so reporting is finished before the page's future resolves"""
+        page_number = page.page_number
+        result = self.process_page(page)
+        if on_page_result:
+            try:
+                on_page_result(page_number, result)
+            except Exception as e:
+                print(f"Page {page_number}: error reporting page result: {str(e)}")
+        return result
+    
+    def _abandon(self, futures):
+        """Cancel the page work of a failed document and wait for what is already running"""
+        for future in futures:
+            future.cancel()
+        wait(futures)
+    
+    def extract_pages(self, pdf_path, on_page_result=None):
+        """Rasterize and extract every page of a PDF, returning the results in page order"""
+        print(f"Processing pages with up to {self.max_workers} concurrent request(s)...")
+        
+        # Pages are rasterized lazily and submitted as soon as they are ready. At most
+        # max_workers + raster_window pages are held in memory at any time.
+        max_pending = self.max_workers + self.raster_window
+        futures = []
+        pending = set()
+        try:
+            for page_number, image, text in self.iter_pdf_pages(pdf_path, use_text_layer=self.use_text_layer):
+                while len(pending) >= max_pending:
+                    _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                if text is not None:
+                    print(f"Page {page_number}: using text layer ({len(text)} characters) instead of an image")
+                page = PageImage(image, page_number, self.preprocessor, text=text, dpi=self.render_dpi, source=pdf_path)
+                del image
+                # Page threads record their metrics against the job of the submitting thread
+                # Each page is reported as soon as it finishes, in completion order
+                future = self.page_executor.submit(contextvars.copy_context().run, self._process_reported_page,
+                                                   page, on_page_result)
+                futures.append(future)
+                pending.add(future)
+                del page
+        except BaseException:
+            # A page that cannot be rendered fails the whole document
+            self._abandon(futures)
+            raise
+        
+        # Results are collected in page order
+        return [future.result() for future in futures]
+    
+    def _classify_for_group(self, page):
+        """Classify a page and encode it for extraction, returning its type (None if unknown) and estimated tokens"""
+        try:
+            doc_type = self.detect_document_type(page)
+            print(f"Page {page.page_number}: detected document type: {doc_type}")
+            if page.text is not None:
+                return (doc_type if doc_type in EXTRACTION_PROMPTS else None), len(page.text) // 4
+            self.encode_image(page, "extract")
+            tokens = estimate_image_tokens(*page.stats("extract")["encoded_size"])
+            return (doc_type if doc_type in EXTRACTION_PROMPTS else None), tokens
+        except Exception as e:
+            print(f"Page {page.page_number}: error classifying page: {str(e)}")
+            return None, 0
+    
+    def _extract_group(self, doc_type, pages):
+        """Extract a run of pages as one document, returning a list of results that cover the pages"""
+        # Unknown pages and runs whose grouped request fails are extracted one page at a time
+        page_numbers = [page.page_number for page in pages]
+        label = f"Pages {page_numbers[0]}-{page_numbers[-1]}" if len(pages) > 1 else f"Page {page_numbers[0]}"
+        try:
+            if doc_type is None:
+                return [{**self.process_page(page), "pages": [page.page_number]} for page in pages]
             
-            results.append(result)
+            cache_key = None
+            if self.cache:
+                content_hash = hashlib.sha256("|".join(
+                    hash_text(page.text) if page.text is not None else hash_image(page.image) for page in pages
+                ).encode("utf-8")).hexdigest()
+                cache_key = self.cache.make_key(f"group:{doc_type}:{content_hash}", self.cache_namespace)
+                cached = self.cache.get_page(cache_key)
+                metrics.record_cache_lookup("page", cached is not None)
+                if cached is not None:
+                    print(f"{label}: using cached {doc_type} result")
+                    # The same pages can sit elsewhere in another PDF, so the cached page numbers are replaced
+                    cached["pages"] = page_numbers
+                    for _ in pages:
+                        metrics.record_page(True)
+                    return [cached]
+            
+            with metrics.timed("group"):
+                result = self.analyze_document_group(doc_type, pages)
+                problems = self._validation_problems(pages, result, label)
+                if problems:
+                    result = self._escalate(pages, result, problems, label)
+            if "error" not in result:
+                result["pages"] = page_numbers
+                if cache_key and "warnings" not in result:
+                    self.cache.set_page(cache_key, result)
+                print(f"{label}: extracted as one {doc_type}")
+                for _ in pages:
+                    metrics.record_page(True)
+                return [result]
+            if len(pages) == 1:
+                metrics.record_page(False)
+                return [{**result, "pages": page_numbers}]
+            print(f"{label}: grouped extraction failed ({result['error']}), extracting pages one by one")
+            return [{**self.process_page(page), "pages": [page.page_number]} for page in pages]
+        except Exception as e:
+            print(f"{label}: error processing pages: {str(e)}")
+            for _ in pages:
+                metrics.record_page(False)
+            return [{"error": f"Failed to process pages: {str(e)}", "pages": page_numbers}]
+        finally:
+            for page in pages:
+                page.release()
+    
+    def _extract_reported_group(self, doc_type, pages, on_page_result):
+        """Extract a run of pages and report its results, so reporting is finished before the run's future resolves"""
+        results = self._extract_group(doc_type, pages)
+        if on_page_result:
+            # Each document is reported under its first page number
+            try:
+                for result in results:
+                    on_page_result(result["pages"][0], result)
+            except Exception as e:
+                print(f"Error reporting grouped page results: {str(e)}")
+        return results
+    
+    def extract_grouped(self, pdf_path, on_page_result=None):
+        """Rasterize and classify every page, then extract runs of same-type pages together, returning one result per document"""
+        print(f"Processing pages in groups of up to {self.group_max_pages} with up to {self.max_workers} concurrent request(s)...")
+        
+        # Pages are classified concurrently but grouped in page order. A run of pages is closed and
+        # submitted when the type changes or the page or token budget of one request would be exceeded.
+        max_pending = self.max_workers + self.raster_window
+        classifying = collections.deque()
+        group_futures = []
+        group = []
+        group_type = None
+        group_tokens = 0
+        
+        def submit_group():
+            nonlocal group, group_type, group_tokens
+            if group:
+                # Bound the number of runs held in memory while they wait for a request slot
+                while sum(not future.done() for future in group_futures) >= self.max_workers:
+                    wait([future for future in group_futures if not future.done()], return_when=FIRST_COMPLETED)
+                future = self.page_executor.submit(contextvars.copy_context().run, self._extract_reported_group,
+                                                   group_type, group, on_page_result)
+                group_futures.append(future)
+            group, group_type, group_tokens = [], None, 0
+        
+        def add_to_group(page, doc_type, tokens):
+            nonlocal group_type, group_tokens
+            if (group_type is None or doc_type != group_type or len(group) >= self.group_max_pages
+                    or group_tokens + tokens > self.group_max_tokens):
+                submit_group()
+            group.append(page)
+            group_type = doc_type
+            group_tokens += tokens
+        
+        try:
+            for page_number, image, text in self.iter_pdf_pages(pdf_path, use_text_layer=self.use_text_layer):
+                while len(classifying) >= max_pending:
+                    page, future = classifying.popleft()
+                    add_to_group(page, *future.result())
+                if text is not None:
+                    print(f"Page {page_number}: using text layer ({len(text)} characters) instead of an image")
+                page = PageImage(image, page_number, self.preprocessor, text=text, dpi=self.render_dpi, source=pdf_path)
+                del image
+                classifying.append((page, self.page_executor.submit(contextvars.copy_context().run, self._classify_for_group, page)))
+                del page
+        except BaseException:
+            # A page that cannot be rendered fails the whole document
+            self._abandon([future for _, future in classifying] + group_futures)
+            raise
+        while classifying:
+            page, future = classifying.popleft()
+            add_to_group(page, *future.result())
+        submit_group()
+        
+        # Documents are collected in page order
+        return [result for future in group_futures for result in future.result()]
+    
+    def process_pdf(self, pdf_path, output_path=None, send_to_api=True, on_page_result=None, timings=None):
+        """Process PDF and extract information"""
+        # on_page_result(page_number, result) is called as each page finishes, and stage
+        # times, tokens, retries and cache hits are added to timings (a metrics.JobTimings)
+        with metrics.track_job(timings or metrics.JobTimings()), metrics.timed("document"):
+            return self._process_pdf(pdf_path, output_path, send_to_api, on_page_result)
+    
+    def _process_pdf(self, pdf_path, output_path, send_to_api, on_page_result):
+        # A previously processed PDF is answered from the cache without rasterizing it
+        results = None
+        document_key = None
+        if self.cache:
+            try:
+                document_key = self.cache.make_key(hash_file(pdf_path), self.cache_namespace)
+                results = self.cache.get_document(document_key)
+                metrics.record_cache_lookup("document", results is not None)
+            except OSError as e:
+                print(f"Error reading PDF for the result cache: {e}")
+        
+        if results is not None:
+            print(f"Using cached results for {sum(len(result.get('pages', [None])) for result in results)} page(s)")
+            if on_page_result:
+                # Grouped results cover several pages and are reported under the first of them
+                for page_number, result in enumerate(results, start=1):
+                    on_page_result(result.get("pages", [page_number])[0], result)
+        else:
+            if self.grouped_extraction:
+                results = self.extract_grouped(pdf_path, on_page_result)
+            else:
+                results = self.extract_pages(pdf_path, on_page_result)
+            if document_key and results and not any("error" in result or "warnings" in result for result in results):
+                self.cache.set_document(document_key, results)
+        
+        if self.cache:
+            print(f"Result cache: {self.cache.stats()}")
         
         # Save results to JSON file if output path is provided
         if output_path:
@@ -291,19 +931,170 @@ class InvoiceProcessor:
         # Send data to ASN API if requested
         api_response = None
         if send_to_api:
-            api_response = self.send_to_asn_api(results)
+            # With the outbox, delivery happens in the background and never re-runs extraction
+            if self.outbox:
+                api_response = self.queue_for_asn_api(results)
+            else:
+                api_response = self.send_to_asn_api(results)
             print("API Response:", json.dumps(api_response, indent=2))
         
         return results, api_response
+    
+    def _process_batch_file(self, pdf_path, output_path, send_to_api, timings=None):
+        """Process one PDF of a batch and return (page count, failed page count, error)"""
+        try:
+            results, api_response = self.process_pdf(pdf_path, output_path, send_to_api=send_to_api, timings=timings)
+        except Exception as e:
+            print(f"Error processing {pdf_path}: {str(e)}")
+            return 0, 0, str(e)
+        
+        # Grouped results cover several pages each
+        page_count = sum(len(result.get("pages", [None])) for result in results)
+        failed_pages = sum(len(result.get("pages", [None])) for result in results if "error" in result)
+        if not results:
+            return 0, 0, "No pages could be extracted"
+        if send_to_api and not (api_response and api_response.get("success")):
+            return page_count, failed_pages, "Failed to send data to ASN API"
+        return page_count, failed_pages, None
+    
+    def process_batch(self, pdf_paths, output_dir=None, send_to_api=True, jobs=None, resume=True, timings=None):
+        """Process many PDFs concurrently, writing one result JSON file per PDF"""
+        # Every document's stage times are added to the same timings
+        jobs = max(1, jobs or BATCH_JOBS)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        
+        # Skip PDFs that already have a complete result file from an earlier run
+        todo = []
+        skipped = 0
+        for pdf_path in pdf_paths:
+            output_path = batch_output_path(pdf_path, output_dir)
+            if resume and has_complete_results(output_path):
+                skipped += 1
+            else:
+                todo.append((pdf_path, output_path))
+        print(f"Batch: {len(todo)} PDF(s) to process, {skipped} already done, {jobs} at a time")
+        
+        # Rasterization runs in poppler subprocesses, so threads are enough to overlap it with
+        # model requests. Every document shares this processor's page pool and rate limit.
+        start = time.perf_counter()
+        summary = {"documents": 0, "pages": 0, "failed_documents": [], "failed_pages": 0, "skipped": skipped}
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="batch") as executor:
+            futures = {
+                executor.submit(self._process_batch_file, pdf_path, output_path, send_to_api, timings): pdf_path
+                for pdf_path, output_path in todo
+            }
+            for future in as_completed(futures):
+                pages, failed_pages, error = future.result()
+                summary["documents"] += 1
+                summary["pages"] += pages
+                summary["failed_pages"] += failed_pages
+                if error or failed_pages:
+                    summary["failed_documents"].append({"pdf_path": futures[future], "error": error or f"{failed_pages} page(s) failed"})
+        
+        elapsed = time.perf_counter() - start
+        summary["elapsed_seconds"] = round(elapsed, 2)
+        summary["documents_per_minute"] = round(summary["documents"] * 60 / elapsed, 2) if elapsed else 0.0
+        summary["pages_per_minute"] = round(summary["pages"] * 60 / elapsed, 2) if elapsed else 0.0
+        return summary
+
+def collect_pdf_paths(source):
+    """PDF paths from a directory, a glob pattern or a manifest file with one path per line"""
+    if os.path.isdir(source):
+        return sorted(set(glob.glob(os.path.join(source, "**", "*.pdf"), recursive=True) +
+                          glob.glob(os.path.join(source, "**", "*.PDF"), recursive=True)))
+    if os.path.isfile(source) and not source.lower().endswith(".pdf"):
+        # Manifest: relative paths are resolved against the manifest's directory
+        base_dir = os.path.dirname(os.path.abspath(source))
+        with open(source, encoding="utf-8") as f:
+            lines = [line.strip() for line in f]
+        return [os.path.join(base_dir, line) for line in lines if line and not line.startswith("#")]
+    return sorted(glob.glob(source, recursive=True))
+
+def batch_output_path(pdf_path, output_dir=None):
+    """Result JSON path for a PDF, next to it or inside output_dir"""
+    name = os.path.splitext(os.path.basename(pdf_path))[0] + '_results.json'
+    return os.path.join(output_dir, name) if output_dir else os.path.splitext(pdf_path)[0] + '_results.json'
+
+def has_complete_results(output_path):
+    """Whether a result file exists and every page in it was extracted without errors"""
+    try:
+        with open(output_path, encoding="utf-8") as f:
+            results = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return bool(results) and not any("error" in result for result in results)
+
+def print_timings(summary):
+    """Print a job's per-stage timing summary, slowest stage first"""
+    print(f"\nTimings ({summary['elapsed_seconds']}s elapsed):")
+    for stage, stage_summary in sorted(summary['stages'].items(), key=lambda item: -item[1]['seconds']):
+        print(f"  {stage:<12} {stage_summary['seconds']:>9.3f}s ({stage_summary['cpu_seconds']:.3f}s CPU) "
+              f"over {stage_summary['count']} call(s)")
+    counters = {name: value for name, value in summary.items() if name not in ('elapsed_seconds', 'stages')}
+    if counters:
+        print("  " + ", ".join(f"{name}={value}" for name, value in sorted(counters.items())))
 
 def main():
     parser = argparse.ArgumentParser(description='Process invoices and packing lists from PDF files.')
-    parser.add_argument('pdf_path', help='Path to the PDF file')
+    parser.add_argument('pdf_path', nargs='?', help='Path to the PDF file')
     parser.add_argument('--output', '-o', help='Path to save the output JSON file')
     parser.add_argument('--no-api', action='store_true', help='Skip sending data to ASN API')
+    parser.add_argument('--workers', '-w', type=int, default=None,
+                        help=f'Maximum number of concurrent model requests (default: {MAX_CONCURRENT_REQUESTS})')
+    parser.add_argument('--two-step', action='store_true',
+                        help='Use a separate classification request before extraction instead of a single combined request')
+    parser.add_argument('--grouped', action='store_true',
+                        help='Extract runs of consecutive pages of the same type in one request, returning one result per document')
+    parser.add_argument('--no-local-classifier', action='store_true',
+                        help='Always ask the model for the document type instead of classifying pages locally first')
+    parser.add_argument('--no-adaptive-dpi', action='store_true',
+                        help='Render every page at IMAGE_SOURCE_DPI instead of a lower draft DPI first')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the result cache')
+    parser.add_argument('--no-text-layer', action='store_true',
+                        help='Always send page images, even for pages with a usable text layer')
+    parser.add_argument('--batch', '-b',
+                        help='Process every PDF in a directory, glob pattern (quoted) or manifest file with one path per line')
+    parser.add_argument('--output-dir', help='Directory for the per-file result JSON in batch mode (default: next to each PDF)')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help=f'Number of PDFs processed at the same time in batch mode (default: {BATCH_JOBS})')
+    parser.add_argument('--force', action='store_true', help='Reprocess PDFs that already have complete results in batch mode')
     args = parser.parse_args()
     
-    processor = InvoiceProcessor()
+    if bool(args.pdf_path) == bool(args.batch):
+        parser.error('provide either a PDF path or --batch')
+    
+    timings = metrics.JobTimings()
+    processor = InvoiceProcessor(max_workers=args.workers,
+                                 combined_extraction=False if args.two_step else None,
+                                 grouped_extraction=True if args.grouped else None,
+                                 use_local_classifier=False if args.no_local_classifier else None,
+                                 adaptive_dpi=False if args.no_adaptive_dpi else None,
+                                 use_cache=False if args.no_cache else None,
+                                 use_text_layer=False if args.no_text_layer else None)
+    
+    if args.batch:
+        pdf_paths = collect_pdf_paths(args.batch)
+        if not pdf_paths:
+            print(f"No PDF files found for {args.batch}")
+            return
+        summary = processor.process_batch(pdf_paths, args.output_dir, send_to_api=not args.no_api,
+                                          jobs=args.jobs, resume=not args.force, timings=timings)
+        
+        # Print aggregate throughput summary
+        print(f"\nProcessed {summary['documents']} document(s) and {summary['pages']} page(s) "
+              f"in {summary['elapsed_seconds']}s ({summary['skipped']} skipped)")
+        print(f"Throughput: {summary['documents_per_minute']} docs/min, {summary['pages_per_minute']} pages/min")
+        print(f"Failures: {len(summary['failed_documents'])} document(s), {summary['failed_pages']} page(s)")
+        for failure in summary['failed_documents']:
+            print(f"  {failure['pdf_path']}: {failure['error']}")
+        print_timings(timings.summary())
+        
+        # Give the outbox a chance to deliver everything before exiting
+        if processor.outbox and not args.no_api:
+            processor.outbox.flush()
+            print(f"ASN outbox: {processor.outbox.stats()}")
+        return
     
     # If no output path is provided, use the PDF filename with .json extension
     if not args.output:
@@ -312,17 +1103,36 @@ def main():
         output_path = args.output
     
     # Process PDF and optionally send to API
-    results, api_response = processor.process_pdf(args.pdf_path, output_path, send_to_api=not args.no_api)
+    try:
+        results, api_response = processor.process_pdf(args.pdf_path, output_path, send_to_api=not args.no_api,
+                                                      timings=timings)
+    except Exception as e:
+        print(f"Error processing {args.pdf_path}: {str(e)}")
+        sys.exit(1)
     
     # Print summary
     for i, result in enumerate(results):
+        pages = result.get('pages', [i + 1])
+        label = f"Pages {pages[0]}-{pages[-1]}" if len(pages) > 1 else f"Page {pages[0]}"
         if 'error' in result:
-            print(f"Page {i+1}: Error - {result['error']}")
+            print(f"{label}: Error - {result['error']}")
         else:
-            print(f"Page {i+1}: Successfully extracted {result['type']} data")
+            print(f"{label}: Successfully extracted {result['type']} data")
+    print_timings(timings.summary())
     
+    # Wait for the outbox to deliver the data; anything still pending is retried on the next run
+    if not args.no_api and api_response and api_response.get('queued'):
+        processor.outbox.flush()
+        entry = processor.outbox.get(api_response['outbox_id'])
+        if entry and entry['status'] == 'sent':
+            print("\nSuccessfully sent data to ASN API")
+        else:
+            status = entry['status'] if entry else 'unknown'
+            retry = ("Process the PDF again to retry it" if status == FAILED
+                     else "It will be retried by the next run or the API server")
+            print(f"\nData not yet delivered to ASN API (outbox entry {api_response['outbox_id']}, {status}). {retry}.")
     # Print API response summary if data was sent to API
-    if not args.no_api:
+    elif not args.no_api:
         if api_response and api_response.get('success'):
             print("\nSuccessfully sent data to ASN API")
         else:
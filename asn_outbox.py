@@ -0,0 +1,241 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+import dotenv
+from concurrent.futures import ThreadPoolExecutor
+from sqlite_db import connect, enable_wal
+
+# Load environment variables from .env file if it exists
+dotenv.load_dotenv()
+
+# ASN outbox configuration
+ASN_OUTBOX_ENABLED = os.getenv("ASN_OUTBOX_ENABLED", "True").lower() == "true"
+ASN_OUTBOX_PATH = os.getenv("ASN_OUTBOX_PATH", "asn_outbox.sqlite3")
+# Documents merged into one ASN API request (1 keeps one request per processed PDF)
+ASN_BATCH_SIZE = int(os.getenv("ASN_BATCH_SIZE", "1"))
+ASN_SEND_CONCURRENCY = int(os.getenv("ASN_SEND_CONCURRENCY", "2"))  # ASN API requests in flight
+ASN_MAX_ATTEMPTS = int(os.getenv("ASN_MAX_ATTEMPTS", "10"))  # Delivery attempts before an entry is given up
+ASN_RETRY_BASE = float(os.getenv("ASN_RETRY_BASE", "5"))  # Seconds, doubled on every failed attempt
+ASN_RETRY_MAX = float(os.getenv("ASN_RETRY_MAX", "900"))  # Seconds
+ASN_POLL_INTERVAL = float(os.getenv("ASN_POLL_INTERVAL", "5"))  # Seconds between outbox scans
+ASN_SEND_LEASE = float(os.getenv("ASN_SEND_LEASE", "300"))  # Seconds before an unfinished send is retried
+ASN_FLUSH_TIMEOUT = float(os.getenv("ASN_FLUSH_TIMEOUT", "60"))  # Seconds the CLI waits for delivery before exiting
+
+# Outbox entry statuses
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+def normalize_vendor(name):
+    """Vendor name reduced to lowercase words, so spacing and punctuation differences do not matter"""
+    return " ".join(re.findall(r"[^\W_]+", str(name or "").lower()))
+
+
+def idempotency_key(results):
+    """Stable key for a document submission, derived from its vendor and invoice and packing list numbers"""
+    # Different suppliers reuse the same invoice numbers, so the vendor is part of every number
+    numbers = sorted(
+        f"{result.get('type')}:{normalize_vendor(result['data'].get('vendor_name'))}:"
+        f"{result['data'].get('invoice_no') or result['data'].get('packing_list_no')}"
+        for result in results
+        if isinstance(result.get("data"), dict)
+        and (result["data"].get("invoice_no") or result["data"].get("packing_list_no"))
+    )
+    # Documents without any number fall back to a hash of their content
+    basis = "|".join(numbers) if numbers else json.dumps(results, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(basis.encode("utf-8")).hexdigest()[:32]
+
+
+class AsnOutbox:
+    """Durable SQLite outbox that delivers extraction results to the ASN API in the background"""
+
+    def __init__(self, send, path=None, batch_size=None, concurrency=None, max_attempts=None):
+        # send(payload, idempotency_key) posts a list of results and returns (success, details)
+        self.send = send
+        self.path = path or ASN_OUTBOX_PATH
+        self.batch_size = max(1, batch_size or ASN_BATCH_SIZE)
+        self.concurrency = max(1, concurrency or ASN_SEND_CONCURRENCY)
+        self.max_attempts = max_attempts or ASN_MAX_ATTEMPTS
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._sender = None
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        enable_wal(self.path)
+        with connect(self.path, immediate=True) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, idempotency_key TEXT NOT NULL UNIQUE, "
+                "payload TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+                "next_attempt_at REAL NOT NULL, last_error TEXT, response TEXT, "
+                "created_at REAL NOT NULL, sent_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+
+    def enqueue(self, results):
+        """Store a document's results for delivery and return the outbox entry"""
+        # Resubmitting a document that was already sent is a no-op, and the entry is flagged as a
+        # conflict if its data differs from what was sent. Any other entry with the same key takes the
+        # new results, so a corrected PDF replaces the old data and a failed entry is retried from scratch.
+        key = idempotency_key(results)
+        payload = json.dumps(results, ensure_ascii=False)
+        now = time.time()
+        with connect(self.path, immediate=True) as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, payload, status, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, payload, PENDING, now, now)
+            )
+            conn.execute(
+                "UPDATE outbox SET payload = ?, status = ?, attempts = 0, next_attempt_at = ?, last_error = NULL "
+                "WHERE idempotency_key = ? AND status IN (?, ?)",
+                (payload, PENDING, now, key, PENDING, FAILED)
+            )
+            # An entry being sent keeps its lease. _deliver notices the new payload and sends it again.
+            conn.execute(
+                "UPDATE outbox SET payload = ?, attempts = 0 WHERE idempotency_key = ? AND status = ?",
+                (payload, key, SENDING)
+            )
+            row = conn.execute("SELECT id, status, payload FROM outbox WHERE idempotency_key = ?", (key,)).fetchone()
+        self.start()
+        self._wake.set()
+        entry = {"outbox_id": row["id"], "idempotency_key": key, "status": row["status"]}
+        if row["status"] == SENT and json.loads(row["payload"]) != results:
+            entry["conflict"] = True
+        return entry
+
+    def _claim(self, limit):
+        """Mark up to limit due entries as being sent and return them"""
+        now = time.time()
+        with connect(self.path, immediate=True) as conn:
+            rows = conn.execute(
+                "SELECT id, idempotency_key, payload, attempts FROM outbox "
+                "WHERE status IN (?, ?) AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+                (PENDING, SENDING, now, limit)
+            ).fetchall()
+            for row in rows:
+                # The lease makes an entry due again if this process dies while sending it
+                conn.execute(
+                    "UPDATE outbox SET status = ?, next_attempt_at = ? WHERE id = ?",
+                    (SENDING, now + ASN_SEND_LEASE, row["id"])
+                )
+        return [dict(row) for row in rows]
+
+    def _deliver(self, entries):
+        """Send a batch of entries as one ASN API request and record the outcome"""
+        payload = [result for entry in entries for result in json.loads(entry["payload"])]
+        key = entries[0]["idempotency_key"] if len(entries) == 1 else hashlib.sha256(
+            "|".join(entry["idempotency_key"] for entry in entries).encode("utf-8")).hexdigest()[:32]
+        try:
+            success, details = self.send(payload, key)
+        except Exception as e:
+            success, details = False, {"error": str(e)}
+
+        now = time.time()
+        with connect(self.path, immediate=True) as conn:
+            for entry in entries:
+                attempts = entry["attempts"] + 1
+                # Entries whose payload was replaced while this request was in flight are sent again
+                if success:
+                    updated = conn.execute(
+                        "UPDATE outbox SET status = ?, attempts = ?, response = ?, sent_at = ?, last_error = NULL "
+                        "WHERE id = ? AND payload = ?",
+                        (SENT, attempts, json.dumps(details, ensure_ascii=False), now, entry["id"], entry["payload"])
+                    ).rowcount
+                else:
+                    delay = random.uniform(0.5, 1.0) * min(ASN_RETRY_MAX, ASN_RETRY_BASE * 2 ** entry["attempts"])
+                    status = FAILED if attempts >= self.max_attempts else PENDING
+                    updated = conn.execute(
+                        "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? "
+                        "WHERE id = ? AND payload = ?",
+                        (status, attempts, now + delay, json.dumps(details, ensure_ascii=False), entry["id"], entry["payload"])
+                    ).rowcount
+                if not updated:
+                    conn.execute(
+                        "UPDATE outbox SET status = ?, next_attempt_at = ? WHERE id = ?",
+                        (PENDING, now, entry["id"])
+                    )
+        if success:
+            print(f"Delivered {len(entries)} outbox entr{'y' if len(entries) == 1 else 'ies'} to ASN API")
+        else:
+            print(f"Failed to deliver {len(entries)} outbox entr{'y' if len(entries) == 1 else 'ies'} to ASN API: {details}")
+        return success
+
+    def drain_once(self):
+        """Send every entry that is currently due, returning the number of entries attempted"""
+        entries = self._claim(self.batch_size * self.concurrency)
+        if not entries:
+            return 0
+        batches = [entries[i:i + self.batch_size] for i in range(0, len(entries), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(self._deliver, batches))
+        return len(entries)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.drain_once():
+                    continue
+            except Exception as e:
+                print(f"Error draining ASN outbox: {str(e)}")
+            self._wake.wait(ASN_POLL_INTERVAL)
+            self._wake.clear()
+
+    def start(self):
+        """Start the background sender if it is not running yet"""
+        with self._lock:
+            if self._sender is None or not self._sender.is_alive():
+                self._stop.clear()
+                self._sender = threading.Thread(target=self._run, name="asn-outbox", daemon=True)
+                self._sender.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _unsettled(self):
+        """Number of entries being sent or due to be sent now"""
+        with connect(self.path, immediate=True) as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE status = ? OR (status = ? AND next_attempt_at <= ?)",
+                (SENDING, PENDING, time.time())
+            ).fetchone()[0]
+
+    def flush(self, timeout=None):
+        """Wait until no entry is being sent or due, returning False if the timeout expires first"""
+        # Entries waiting out a retry delay are left for the background sender
+        self.start()
+        deadline = time.time() + (ASN_FLUSH_TIMEOUT if timeout is None else timeout)
+        while time.time() < deadline:
+            self._wake.set()
+            if not self._unsettled():
+                return True
+            time.sleep(0.2)
+        return False
+
+    def get(self, outbox_id):
+        """Delivery status of an outbox entry, or None"""
+        with connect(self.path, immediate=True) as conn:
+            row = conn.execute(
+                "SELECT id, idempotency_key, status, attempts, last_error, response, created_at, sent_at "
+                "FROM outbox WHERE id = ?", (outbox_id,)
+            ).fetchone()
+        if not row:
+            return None
+        entry = dict(row)
+        for field in ("last_error", "response"):
+            entry[field] = json.loads(entry[field]) if entry[field] else None
+        return entry
+
+    def stats(self):
+        """Number of outbox entries per status"""
+        with connect(self.path, immediate=True) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS count FROM outbox GROUP BY status").fetchall()
+        return {row["status"]: row["count"] for row in rows}
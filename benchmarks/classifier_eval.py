@@ -0,0 +1,95 @@
+import os
+import csv
+import sys
+import time
+import argparse
+import tempfile
+from PIL import Image
+from pdf2image import convert_from_path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from page_classifier import PageClassifier, CLASSIFIER_MIN_CONFIDENCE
+from text_layer import TEXT_LAYER_ENABLED, extract_page_texts, is_usable_text, compact_text
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# (path, page, label) of the sample shipped with the repository
+DEFAULT_SAMPLES = [
+    (os.path.join(ROOT_DIR, "BTPL_240219_invoice_and_packing_list.pdf"), 1, "invoice"),
+    (os.path.join(ROOT_DIR, "BTPL_240219_invoice_and_packing_list.pdf"), 2, "packing_list"),
+]
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".webp")
+
+
+def load_manifest(path):
+    """(path, page, label) rows of a CSV manifest with path,page,label columns"""
+    # Relative paths are resolved against the manifest's directory, and page is ignored for images
+    base_dir = os.path.dirname(os.path.abspath(path))
+    samples = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            sample_path = os.path.join(base_dir, row["path"])
+            page = int(row["page"]) if (row.get("page") or "").strip() else 1
+            samples.append((sample_path, page, row["label"].strip()))
+    return samples
+
+
+def load_page(path, page, use_text_layer, dpi):
+    """(image, text) of a sample page as the pipeline would see it"""
+    # Pages with a usable text layer reach the classifier as text only, like in the pipeline
+    if path.lower().endswith(IMAGE_EXTENSIONS):
+        with Image.open(path) as image:
+            return image.convert("RGB"), None
+    if use_text_layer:
+        text = extract_page_texts(path, page, page)[0]
+        if is_usable_text(text):
+            return None, compact_text(text)
+    return convert_from_path(path, dpi=dpi, first_page=page, last_page=page, use_pdftocairo=True)[0], None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how many pages the local page classifier decides, and how accurately, on labelled samples.")
+    parser.add_argument("manifest", nargs="?", help="CSV file with path,page,label columns (default: the BTPL sample PDF)")
+    parser.add_argument("--passes", type=int, default=2, help="Times to go through the samples; later passes show the effect of learned templates")
+    parser.add_argument("--min-confidence", type=float, default=CLASSIFIER_MIN_CONFIDENCE, help="Confidence needed for a local decision")
+    parser.add_argument("--no-learn", action="store_true", help="Do not add pages to the template index after they are classified")
+    parser.add_argument("--no-text-layer", action="store_true", help="Classify every page from its image")
+    parser.add_argument("--dpi", type=int, default=150, help="Resolution pages are rendered at")
+    args = parser.parse_args()
+
+    samples = load_manifest(args.manifest) if args.manifest else DEFAULT_SAMPLES
+    use_text_layer = TEXT_LAYER_ENABLED and not args.no_text_layer
+    pages = [(path, page, label, *load_page(path, page, use_text_layer, args.dpi)) for path, page, label in samples]
+    print(f"{len(pages)} labelled page(s), minimum confidence {args.min_confidence:.2f}\n")
+
+    with tempfile.TemporaryDirectory(prefix="classifier_eval_") as work_dir:
+        # The index starts empty, so the first pass shows the cold-start hit rate
+        classifier = PageClassifier(os.path.join(work_dir, "page_index.sqlite3"), min_confidence=args.min_confidence)
+        print(f"{'pass':>4}{'pages':>7}{'local':>7}{'hit rate':>10}{'correct':>9}{'accuracy':>10}{'text':>6}{'phash':>7}{'ms/page':>9}")
+        for pass_number in range(1, args.passes + 1):
+            decided = correct = 0
+            sources = {"text": 0, "phash": 0}
+            mistakes = []
+            start = time.perf_counter()
+            for path, page, label, image, text in pages:
+                doc_type, confidence, source = classifier.classify(text, image)
+                if doc_type:
+                    decided += 1
+                    sources[source] += 1
+                    if doc_type == label:
+                        correct += 1
+                    else:
+                        mistakes.append(f"{os.path.basename(path)} page {page}: {label} classified as {doc_type} ({source}, {confidence:.2f})")
+                elif not args.no_learn and image is not None:
+                    # Pages left to the model are learned with its answer, taken here to be the label
+                    classifier.learn(image, label)
+            elapsed_ms = (time.perf_counter() - start) * 1000 / len(pages)
+            accuracy = f"{correct / decided:.1%}" if decided else "-"
+            print(f"{pass_number:>4}{len(pages):>7}{decided:>7}{decided / len(pages):>10.1%}{correct:>9}{accuracy:>10}"
+                  f"{sources['text']:>6}{sources['phash']:>7}{elapsed_ms:>9.2f}")
+            for mistake in mistakes:
+                print(f"    {mistake}")
+        print(f"\nTemplate index: {classifier.size()} page hash(es)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mock_server import MockServer, ROOT_DIR
+
+DEFAULT_PDF = os.path.join(ROOT_DIR, "BTPL_240219_invoice_and_packing_list.pdf")
+
+
+def start_api_server(port):
+    """Run api_server in a background thread and wait until it accepts requests"""
+    import requests
+    import uvicorn
+    import api_server
+
+    server = uvicorn.Server(uvicorn.Config(api_server.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    url = f"http://127.0.0.1:{port}/"
+    for _ in range(100):
+        try:
+            requests.get(url, timeout=1)
+            return server, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError("API server did not start")
+
+
+def upload(url, pdf_path):
+    import requests
+
+    start = time.perf_counter()
+    with open(pdf_path, "rb") as f:
+        response = requests.post(f"{url}process-pdf/", files={"file": (os.path.basename(pdf_path), f, "application/pdf")})
+    return response.status_code, time.perf_counter() - start
+
+
+def health_check_latency(url, stop, samples):
+    """Measure how long the health check takes while uploads are running"""
+    import requests
+
+    while not stop.is_set():
+        start = time.perf_counter()
+        requests.get(url, timeout=30)
+        samples.append(time.perf_counter() - start)
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the /process-pdf/ endpoint against a mock model server.")
+    parser.add_argument("pdf_path", nargs="?", default=DEFAULT_PDF, help="Path to the PDF file to upload")
+    parser.add_argument("--latency", type=float, default=1.0, help="Mock model latency in seconds")
+    parser.add_argument("--uploads", type=int, default=8, help="Uploads per concurrency level")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Comma-separated concurrent upload counts")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the API server under test")
+    args = parser.parse_args()
+
+    mock = MockServer(latency=args.latency).start()
+    # The processor reads its configuration at import time, so point it at the mock first
+    os.environ["MODEL_BASE_URL"] = mock.url
+    os.environ["ASN_API_URL"] = f"{mock.url}asn"
+    os.environ["RESULT_CACHE_ENABLED"] = "False"
+    os.environ.setdefault("API_MAX_CONCURRENT_JOBS", str(max(int(c) for c in args.concurrency.split(","))))
+    server, url = start_api_server(args.port)
+
+    print(f"Mock model latency {args.latency:.2f}s, {args.uploads} upload(s) per level\n")
+    print(f"{'concurrency':>12}{'docs/s':>10}{'p50 s':>10}{'p95 s':>10}{'health p95 s':>15}{'failures':>10}")
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        stop = threading.Event()
+        health = []
+        health_thread = threading.Thread(target=health_check_latency, args=(url, stop, health), daemon=True)
+        health_thread.start()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(lambda _: upload(url, args.pdf_path), range(args.uploads)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        health_thread.join()
+
+        latencies = sorted(latency for _, latency in outcomes)
+        failures = sum(1 for status, _ in outcomes if status != 200)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        health_p95 = sorted(health)[min(len(health) - 1, int(len(health) * 0.95))] if health else 0.0
+        print(f"{concurrency:>12}{args.uploads / elapsed:>10.2f}{statistics.median(latencies):>10.2f}"
+              f"{p95:>10.2f}{health_p95:>15.3f}{failures:>10}")
+
+    server.should_exit = True
+    mock.stop()
+
+
+if __name__ == "__main__":
+    main()
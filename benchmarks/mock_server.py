@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_canned_results():
+    """Lists of sample extraction results keyed by document type, from api_output.json and invoice_package.json"""
+    with open(os.path.join(ROOT_DIR, "api_output.json"), encoding="utf-8") as f:
+        extracted = json.load(f)["extracted_data"]
+    with open(os.path.join(ROOT_DIR, "invoice_package.json"), encoding="utf-8") as f:
+        extracted += json.load(f)
+    canned = {}
+    for result in extracted:
+        canned.setdefault(result["type"], []).append(result["data"])
+    return canned
+
+
+class MockServer:
+    """Local stand-in for the Azure OpenAI chat completions route and the ASN API"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.5, jitter=0.0, throttle_rate=0.0,
+                 retry_after=1.0, asn_failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter  # Seconds added to or taken off the latency at random
+        self.throttle_rate = throttle_rate  # Share of model requests answered with 429
+        self.retry_after = retry_after  # Seconds sent in the Retry-After header of a 429
+        self.asn_failure_rate = asn_failure_rate  # Share of ASN requests answered with 503
+        self.canned = load_canned_results()
+        self.requests = 0
+        self.throttled = 0
+        self.asn_requests = 0
+        self.asn_failures = 0
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def _chat_completion(self, payload):
+        """Canned reply matching the prompt that was sent"""
+        prompt = payload["messages"][-1]["content"][0]["text"]
+        doc_type = "packing_list" if "packing list image" in prompt else "invoice"
+        with self._lock:
+            data = self.random.choice(self.canned[doc_type])
+        if payload.get("max_tokens", 0) <= 50:
+            content = doc_type
+        elif '"type"' in prompt:
+            content = json.dumps({"type": doc_type, "data": data})
+        else:
+            content = json.dumps(data)
+        return {
+            "choices": [{"message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1000, "completion_tokens": len(content) // 4, "total_tokens": 1000 + len(content) // 4},
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+                is_model = "/chat/completions" in self.path
+                with server._lock:
+                    server.requests += 1
+                    roll = server.random.random()
+                    delay = max(0.0, server.latency + server.random.uniform(-server.jitter, server.jitter))
+                    if is_model and roll < server.throttle_rate:
+                        server.throttled += 1
+                        throttled = True
+                    else:
+                        throttled = False
+                    if not is_model:
+                        server.asn_requests += 1
+                        failed = roll < server.asn_failure_rate
+                        server.asn_failures += failed
+
+                if is_model and throttled:
+                    # Throttled requests are rejected straight away, like Azure OpenAI does
+                    self.reply(429, {"error": {"code": "429", "message": "Rate limit exceeded"}},
+                               {"Retry-After": str(server.retry_after)})
+                    return
+                time.sleep(delay)
+                if is_model:
+                    self.reply(200, server._chat_completion(payload))
+                elif failed:
+                    self.reply(503, {"message": "Service unavailable"})
+                else:
+                    # Anything else is treated as the ASN API
+                    self.reply(200, {"message": {"message": "Documents created", "created": [len(payload or [])]}})
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock Azure OpenAI and ASN API server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds to wait before every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random seconds added to or taken off the latency")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of model requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--asn-failure-rate", type=float, default=0.0, help="Share of ASN requests answered with 503")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for repeatable runs")
+    args = parser.parse_args()
+
+    server = MockServer(args.host, args.port, args.latency, args.jitter, args.throttle_rate,
+                        args.retry_after, args.asn_failure_rate, args.seed)
+    print(f"Mock server listening on {server.url}")
+    print(f"Use MODEL_BASE_URL={server.url} and ASN_API_URL={server.url}asn")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import contextlib
+import tempfile
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mock_server import MockServer, ROOT_DIR
+from load_test import start_api_server
+
+DEFAULT_PDF = os.path.join(ROOT_DIR, "BTPL_240219_invoice_and_packing_list.pdf")
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def make_synthetic_pdf(path, pages):
+    """Write a scanned-looking PDF of alternating invoice and packing list pages"""
+    images = []
+    for page_number in range(1, pages + 1):
+        # A4 at 150 DPI with a header and a table of fake line items
+        image = Image.new("RGB", (1240, 1754), "white")
+        draw = ImageDraw.Draw(image)
+        title = "COMMERCIAL INVOICE" if page_number % 2 else "PACKING LIST"
+        draw.text((100, 100), f"{title}  No. SYN-{page_number:04d}", fill="black")
+        for row in range(40):
+            y = 250 + row * 35
+            draw.line((100, y, 1140, y), fill="gray")
+            draw.text((110, y + 10), f"{4170000 + row}   PART {row:03d} SHAFT   {10 + row} PCS   US${row + 1}.00", fill="black")
+        images.append(image)
+    images[0].save(path, "PDF", resolution=150, save_all=True, append_images=images[1:])
+    return path
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class RssSampler:
+    """Track the peak resident set size while a run is in progress"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = current_rss() or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss() or 0)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if not self.peak and resource:
+            # Fall back to the lifetime peak, reported in kilobytes on Linux
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_cli(processor, pdf_path, documents, concurrency):
+    """Process the PDF through InvoiceProcessor.process_pdf, returning (latency, page count, timings) per document"""
+    import metrics
+
+    def process(_):
+        timings = metrics.JobTimings()
+        start = time.perf_counter()
+        results, _ = processor.process_pdf(pdf_path, send_to_api=True, timings=timings)
+        return time.perf_counter() - start, len(results), timings.summary()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(process, range(documents)))
+
+
+def run_api(url, pdf_path, documents, concurrency):
+    """Upload the PDF to /process-pdf/, returning (latency, page count, timings) per document"""
+    import requests
+
+    def upload(_):
+        start = time.perf_counter()
+        with open(pdf_path, "rb") as f:
+            response = requests.post(f"{url}process-pdf/", files={"file": (os.path.basename(pdf_path), f, "application/pdf")})
+        body = response.json()
+        return time.perf_counter() - start, len(body.get("extracted_data") or []), body.get("timings") or {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(upload, range(documents)))
+
+
+def summarize(outcomes, elapsed, peak_rss, cpu_seconds):
+    """Throughput, latency percentiles, memory and per-stage totals of one run"""
+    latencies = sorted(latency for latency, _, _ in outcomes)
+    pages = sum(page_count for _, page_count, _ in outcomes)
+    stages = {}
+    escalated_pages = sum(timings.get("dpi_escalated_pages", 0) for _, _, timings in outcomes)
+    for _, _, timings in outcomes:
+        for stage, totals in timings.get("stages", {}).items():
+            stage_totals = stages.setdefault(stage, {"count": 0, "seconds": 0.0, "cpu_seconds": 0.0})
+            for name in stage_totals:
+                stage_totals[name] += totals.get(name, 0)
+    return {
+        "documents": len(outcomes),
+        "pages": pages,
+        "elapsed_seconds": round(elapsed, 3),
+        "pages_per_second": round(pages / elapsed, 3) if elapsed else 0.0,
+        "p50_seconds": round(statistics.median(latencies), 3),
+        "p95_seconds": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+        "peak_rss_mb": round(peak_rss / 1024 ** 2, 1),
+        "cpu_seconds": round(cpu_seconds, 3),
+        "escalation_rate": round(escalated_pages / pages, 3) if pages else 0.0,
+        "stages": {stage: {name: round(value, 3) for name, value in totals.items()} for stage, totals in stages.items()},
+    }
+
+
+def print_run(label, summary):
+    print(f"{label:<48}{summary['pages_per_second']:>10.2f}{summary['p50_seconds']:>9.2f}{summary['p95_seconds']:>9.2f}"
+          f"{summary['peak_rss_mb']:>12.1f}{summary['cpu_seconds']:>9.2f}{summary['escalation_rate']:>12.1%}")
+    for stage, totals in sorted(summary["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        print(f"    {stage:<14}{totals['seconds']:>9.2f}s wall{totals['cpu_seconds']:>9.2f}s CPU  {int(totals['count']):>5} call(s)")
+
+
+def compare(results, baseline_path, tolerance):
+    """Runs whose pages/sec fell more than tolerance below the baseline"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["runs"]
+    regressions = []
+    for label, summary in results.items():
+        if label in baseline:
+            before = baseline[label]["pages_per_second"]
+            if before and summary["pages_per_second"] < before * (1 - tolerance):
+                regressions.append(f"{label}: {summary['pages_per_second']:.2f} pages/s (baseline {before:.2f})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CLI and API pipelines against a local mock of Azure OpenAI and the ASN API.")
+    parser.add_argument("--pdf", action="append", help=f"PDF to process, can be repeated (default: {os.path.basename(DEFAULT_PDF)})")
+    parser.add_argument("--synthetic-pages", default="10", help="Comma-separated page counts of generated PDFs, empty for none")
+    parser.add_argument("--mode", default="cli,api", help="Comma-separated pipelines to drive: cli, api")
+    parser.add_argument("--documents", type=int, default=4, help="Documents processed per run")
+    parser.add_argument("--concurrency", type=int, default=2, help="Documents processed at the same time")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mock model latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Random seconds added to or taken off the latency")
+    parser.add_argument("--throttle-rate", type=float, default=0.05, help="Share of model requests answered with 429")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the mock server")
+    parser.add_argument("--port", type=int, default=8766, help="Port for the API server under test")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's progress output")
+    parser.add_argument("--output", help="Write the results as JSON, for use as a later --baseline")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare pages/sec against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed pages/sec drop against the baseline")
+    args = parser.parse_args()
+
+    mock = MockServer(latency=args.latency, jitter=args.jitter, throttle_rate=args.throttle_rate,
+                      retry_after=0.5, seed=args.seed).start()
+    # The processor reads its configuration at import time, so point it at the mock first.
+    # The cache would answer repeated documents, the page classifier's template index would carry
+    # over between runs, and the outbox would move the ASN call out of the job.
+    os.environ["MODEL_BASE_URL"] = mock.url
+    os.environ["ASN_API_URL"] = f"{mock.url}asn"
+    os.environ["RESULT_CACHE_ENABLED"] = "False"
+    os.environ["LOCAL_CLASSIFIER_ENABLED"] = "False"
+    os.environ["ASN_OUTBOX_ENABLED"] = "False"
+    os.environ.setdefault("HTTP_BACKOFF_BASE", "0.2")
+    os.environ.setdefault("API_MAX_CONCURRENT_JOBS", str(args.concurrency))
+    from app import InvoiceProcessor
+
+    with tempfile.TemporaryDirectory(prefix="pipeline_benchmark_") as work_dir:
+        pdf_paths = args.pdf or [DEFAULT_PDF]
+        for pages in [int(count) for count in args.synthetic_pages.split(",") if count.strip()]:
+            pdf_paths.append(make_synthetic_pdf(os.path.join(work_dir, f"synthetic_{pages}p.pdf"), pages))
+
+        modes = [mode.strip() for mode in args.mode.split(",") if mode.strip()]
+        processor = InvoiceProcessor() if "cli" in modes else None
+        server, url = start_api_server(args.port) if "api" in modes else (None, None)
+
+        print(f"Mock model latency {args.latency:.2f}s +/- {args.jitter:.2f}s, {args.throttle_rate:.0%} throttled, "
+              f"{args.documents} document(s) per run, {args.concurrency} at a time\n")
+        print(f"{'run':<48}{'pages/s':>10}{'p50 s':>9}{'p95 s':>9}{'peak RSS MB':>12}{'CPU s':>9}{'escalated':>12}")
+        results = {}
+        for pdf_path in pdf_paths:
+            for mode in modes:
+                label = f"{mode}:{os.path.basename(pdf_path)}"
+                requests_before, throttled_before = mock.requests, mock.throttled
+                cpu_before = time.process_time()
+                quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+                with quiet, RssSampler() as sampler:
+                    start = time.perf_counter()
+                    if mode == "cli":
+                        outcomes = run_cli(processor, pdf_path, args.documents, args.concurrency)
+                    else:
+                        outcomes = run_api(url, pdf_path, args.documents, args.concurrency)
+                    elapsed = time.perf_counter() - start
+                summary = summarize(outcomes, elapsed, sampler.peak, time.process_time() - cpu_before)
+                summary["mock_requests"] = mock.requests - requests_before
+                summary["mock_throttled"] = mock.throttled - throttled_before
+                results[label] = summary
+                print_run(label, summary)
+
+    if server:
+        server.should_exit = True
+    mock.stop()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "runs": results}, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        if regressions:
+            print("\nThroughput regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo run is more than {args.tolerance:.0%} slower than {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
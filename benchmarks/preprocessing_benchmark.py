@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import argparse
+from pdf2image import convert_from_path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_preprocessing import ImagePreprocessor
+
+DEFAULT_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "BTPL_240219_invoice_and_packing_list.pdf")
+
+# (label, purpose, ImagePreprocessor keyword arguments)
+SETTINGS = [
+    ("png-300dpi (original)", "extract", {"image_format": "PNG", "target_dpi": 300, "max_edge": 100000}),
+    ("png-200dpi", "extract", {"image_format": "PNG", "target_dpi": 200}),
+    ("jpeg-q85-200dpi", "extract", {"image_format": "JPEG", "quality": 85, "target_dpi": 200}),
+    ("jpeg-q70-150dpi", "extract", {"image_format": "JPEG", "quality": 70, "target_dpi": 150}),
+    ("jpeg-q85-gray-crop", "extract", {"image_format": "JPEG", "quality": 85, "grayscale": True, "crop_whitespace": True}),
+    ("webp-q80-200dpi", "extract", {"image_format": "WEBP", "quality": 80, "target_dpi": 200}),
+    ("webp-q80-gray-crop", "extract", {"image_format": "WEBP", "quality": 80, "grayscale": True, "crop_whitespace": True}),
+    ("jpeg-q70-thumbnail", "classify", {"image_format": "JPEG", "quality": 70}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image preprocessing settings on a PDF.")
+    parser.add_argument("pdf_path", nargs="?", default=DEFAULT_PDF, help="Path to the PDF file")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of encodes per page and setting")
+    args = parser.parse_args()
+
+    images = convert_from_path(args.pdf_path, dpi=300, fmt="png", use_pdftocairo=True)
+    print(f"{args.pdf_path}: {len(images)} page(s) rendered at 300 DPI\n")
+    print(f"{'setting':<24}{'page':>6}{'size':>12}{'encode ms':>12}{'payload KB':>12}{'vs original':>13}")
+
+    baseline = {}
+    for label, purpose, options in SETTINGS:
+        preprocessor = ImagePreprocessor(**options)
+        for page_number, image in enumerate(images, start=1):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                data_url, stats = preprocessor.to_data_url(image, purpose)
+            elapsed_ms = (time.perf_counter() - start) * 1000 / args.repeat
+
+            payload = len(data_url)
+            baseline.setdefault(page_number, payload)
+            ratio = payload / baseline[page_number]
+            width, height = stats["encoded_size"]
+            print(f"{label:<24}{page_number:>6}{f'{width}x{height}':>12}{elapsed_ms:>12.1f}"
+                  f"{payload / 1024:>12.1f}{ratio:>12.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+import math
+import time
+import random
+import threading
+import email.utils
+import requests
+import dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+# Load environment variables from .env file if it exists
+dotenv.load_dotenv()
+
+# HTTP client configuration
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))  # Keep-alive connections per host
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))  # Seconds
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))  # Seconds
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "5"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "1"))  # Seconds, doubled on every retry
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "60"))  # Seconds
+
+# Client-side rate limits for Azure OpenAI (0 disables the limit)
+MODEL_REQUESTS_PER_MINUTE = int(os.getenv("MODEL_REQUESTS_PER_MINUTE", "0"))
+MODEL_TOKENS_PER_MINUTE = int(os.getenv("MODEL_TOKENS_PER_MINUTE", "0"))
+
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Statuses that mean the server did not act on the request, safe to retry for non-idempotent calls
+REJECTED_STATUS_CODES = {429}
+
+
+def estimate_image_tokens(width, height):
+    """Approximate prompt tokens for a high-detail image, following the OpenAI tiling rules"""
+    # The image is scaled to fit within 2048x2048 and then so that its short side is at most 768
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def request_not_sent(error):
+    """Whether a connection error happened before the request reached the server"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class RateLimiter:
+    """Token-bucket limiter for requests per minute and tokens per minute"""
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = float(requests_per_minute)
+        self._token_allowance = float(tokens_per_minute)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        if self.requests_per_minute:
+            self._request_allowance = min(self.requests_per_minute,
+                                          self._request_allowance + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._token_allowance = min(self.tokens_per_minute,
+                                        self._token_allowance + elapsed * self.tokens_per_minute / 60)
+
+    def acquire(self, tokens=0):
+        """Block until one request and the given number of tokens fit within the limits"""
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return
+        # A single request larger than the whole budget is allowed once the bucket is full
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                wait_for = 0.0
+                if self.requests_per_minute and self._request_allowance < 1:
+                    wait_for = max(wait_for, (1 - self._request_allowance) * 60 / self.requests_per_minute)
+                if self.tokens_per_minute and self._token_allowance < tokens:
+                    wait_for = max(wait_for, (tokens - self._token_allowance) * 60 / self.tokens_per_minute)
+                if wait_for <= 0:
+                    if self.requests_per_minute:
+                        self._request_allowance -= 1
+                    if self.tokens_per_minute:
+                        self._token_allowance -= tokens
+                    return
+            time.sleep(wait_for)
+
+
+class HttpClient:
+    """Connection-pooled HTTP client with timeouts, retries and optional rate limiting"""
+
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None, max_retries=None,
+                 backoff_base=None, backoff_max=None, rate_limiter=None, idempotent=True):
+        self.connect_timeout = connect_timeout or HTTP_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or HTTP_READ_TIMEOUT
+        self.max_retries = HTTP_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = HTTP_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = backoff_max or HTTP_BACKOFF_MAX
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # Non-idempotent requests are only retried when the server cannot have acted on them
+        self.idempotent = idempotent
+
+        # Keep-alive connections are reused across requests and threads
+        pool_size = pool_size or HTTP_POOL_SIZE
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def retry_after(self, response):
+        """Delay in seconds requested by the server, or None"""
+        # Azure OpenAI sends a millisecond hint alongside the standard header
+        retry_after_ms = response.headers.get("retry-after-ms")
+        if retry_after_ms:
+            try:
+                return float(retry_after_ms) / 1000
+            except ValueError:
+                pass
+
+        retry_after = response.headers.get("Retry-After")
+        if not retry_after:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(retry_after)
+            return max(0.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def backoff(self, attempt, response=None):
+        """Exponential backoff with full jitter, honoring Retry-After when present"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if response is not None:
+            retry_after = self.retry_after(response)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def post(self, url, tokens=0, **kwargs):
+        """POST with retries on throttling, server errors and connection failures"""
+        # The last response is returned with the number of retries in response.retry_count.
+        # Connection errors and timeouts are re-raised once the retries are exhausted.
+        # Without idempotent, only 429 responses and failures to connect are retried.
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(tokens)
+            try:
+                response = self.session.post(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries or not (self.idempotent or request_not_sent(e)):
+                    raise
+                delay = self.backoff(attempt)
+                print(f"Request to {url.split('?')[0]} failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            else:
+                retry_codes = RETRY_STATUS_CODES if self.idempotent else REJECTED_STATUS_CODES
+                if response.status_code not in retry_codes or attempt >= self.max_retries:
+                    response.retry_count = attempt
+                    return response
+                delay = self.backoff(attempt, response)
+                print(f"Request to {url.split('?')[0]} returned {response.status_code}, retrying in {delay:.1f}s")
+                response.close()
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,178 @@
+import os
+import io
+import math
+import base64
+import threading
+import dotenv
+from PIL import Image, ImageOps
+
+# Load environment variables from .env file if it exists
+dotenv.load_dotenv()
+
+# Image preprocessing configuration
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()  # PNG, JPEG or WEBP
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))  # JPEG/WEBP quality (1-100)
+IMAGE_SOURCE_DPI = int(os.getenv("IMAGE_SOURCE_DPI", "300"))  # DPI the pages are rendered at for full quality
+IMAGE_TARGET_DPI = int(os.getenv("IMAGE_TARGET_DPI", "200"))  # DPI sent to the model for extraction
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "2048"))  # Longest edge in pixels for extraction
+CLASSIFY_MAX_EDGE = int(os.getenv("CLASSIFY_MAX_EDGE", "768"))  # Longest edge in pixels for classification
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "False").lower() == "true"
+IMAGE_CROP_WHITESPACE = os.getenv("IMAGE_CROP_WHITESPACE", "False").lower() == "true"
+# Also encode every page as the full-resolution PNG sent before preprocessing, to report the bytes saved
+IMAGE_MEASURE_SAVINGS = os.getenv("IMAGE_MEASURE_SAVINGS", "True").lower() == "true"
+
+MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+# The model scales a high-detail image to fit 2048 pixels on its long side and then 768 on its short side
+MODEL_MAX_EDGE = 2048
+MODEL_SHORT_EDGE = 768
+
+
+def split_into_strips(image, overlap=0.1):
+    """Overlapping horizontal strips of a page, shaped so the model sees each at up to 2048 pixels across"""
+    # A whole A4 page reaches the model at 768 pixels across whatever its DPI, while a strip
+    # 2048/768 times as wide as it is high keeps the full 2048. overlap is the share of a strip
+    # repeated in the next one, so rows cut by a strip edge appear whole in one of them.
+    strip_height = max(1, image.width * MODEL_SHORT_EDGE // MODEL_MAX_EDGE)
+    if image.height <= strip_height:
+        return [image]
+    count = math.ceil((image.height - strip_height) / (strip_height * (1 - overlap))) + 1
+    tops = [round(i * (image.height - strip_height) / (count - 1)) for i in range(count)]
+    return [image.crop((0, top, image.width, top + strip_height)) for top in tops]
+
+
+class ImagePreprocessor:
+    """Shrink rendered pages before they are sent to the model"""
+
+    def __init__(self, image_format=None, quality=None, source_dpi=None, target_dpi=None,
+                 max_edge=None, classify_max_edge=None, grayscale=None, crop_whitespace=None, measure_savings=None):
+        self.image_format = (image_format or IMAGE_FORMAT).upper()
+        if self.image_format not in MIME_TYPES:
+            raise ValueError(f"Unsupported image format: {self.image_format}")
+        self.quality = quality or IMAGE_QUALITY
+        self.source_dpi = source_dpi or IMAGE_SOURCE_DPI
+        self.target_dpi = target_dpi or IMAGE_TARGET_DPI
+        self.max_edge = max_edge or IMAGE_MAX_EDGE
+        self.classify_max_edge = classify_max_edge or CLASSIFY_MAX_EDGE
+        self.grayscale = IMAGE_GRAYSCALE if grayscale is None else grayscale
+        self.crop_whitespace = IMAGE_CROP_WHITESPACE if crop_whitespace is None else crop_whitespace
+        self.measure_savings = IMAGE_MEASURE_SAVINGS if measure_savings is None else measure_savings
+
+    def crop_to_content(self, image, threshold=245, margin=20):
+        """Crop the white border around the page content"""
+        # Anything darker than the threshold counts as content
+        mask = ImageOps.invert(image.convert("L")).point(lambda value: 255 if value > 255 - threshold else 0)
+        bbox = mask.getbbox()
+        if not bbox:
+            return image
+        left, top, right, bottom = bbox
+        return image.crop((
+            max(0, left - margin),
+            max(0, top - margin),
+            min(image.width, right + margin),
+            min(image.height, bottom + margin),
+        ))
+
+    def resize(self, image, max_edge, source_dpi=None):
+        """Scale the image down to the target DPI and maximum long edge"""
+        scale = min(1.0, self.target_dpi / (source_dpi or self.source_dpi), max_edge / max(image.size))
+        if scale >= 1.0:
+            return image
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        return image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+
+    def prepare(self, image, purpose="extract", source_dpi=None):
+        """Apply cropping, resizing and color conversion for the given purpose"""
+        if self.crop_whitespace:
+            image = self.crop_to_content(image)
+        max_edge = self.classify_max_edge if purpose == "classify" else self.max_edge
+        image = self.resize(image, max_edge, source_dpi)
+        if self.grayscale:
+            image = image.convert("L")
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        return image
+
+    def encode(self, image, purpose="extract", source_dpi=None):
+        """Preprocess and encode an image, returning (bytes, mime type, stats)"""
+        # source_dpi is the DPI the image was rendered at, if not IMAGE_SOURCE_DPI
+        original_size = image.size
+        prepared = self.prepare(image, purpose, source_dpi)
+
+        buffered = io.BytesIO()
+        if self.image_format == "PNG":
+            prepared.save(buffered, format="PNG", optimize=False)
+        else:
+            prepared.save(buffered, format=self.image_format, quality=self.quality)
+        data = buffered.getvalue()
+
+        stats = {
+            "purpose": purpose,
+            "original_size": original_size,
+            "encoded_size": prepared.size,
+            "format": self.image_format,
+            "encoded_bytes": len(data),
+        }
+        return data, MIME_TYPES[self.image_format], stats
+
+    def baseline_bytes(self, image):
+        """Size of the page as it was sent before preprocessing: a PNG at the rendered resolution"""
+        buffered = io.BytesIO()
+        image.save(buffered, format="PNG")
+        return len(buffered.getvalue())
+
+    def to_data_url(self, image, purpose="extract", source_dpi=None):
+        """Preprocess an image and return it as a base64 data URL together with its stats"""
+        data, mime_type, stats = self.encode(image, purpose, source_dpi)
+        return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}", stats
+
+
+class PageImage:
+    """A rendered page that is encoded lazily, once per purpose, and reused across model calls"""
+
+    def __init__(self, image, page_number=None, preprocessor=None, text=None, dpi=None, source=None):
+        self.image = image
+        self.page_number = page_number
+        # Pages with a usable text layer carry their text and are sent without an image
+        self.text = text
+        # DPI the image was rendered at, and the PDF it was rendered from so it can be rendered again
+        self.dpi = dpi
+        self.source = source
+        self.preprocessor = preprocessor or ImagePreprocessor()
+        self._encoded = {}
+        self._baseline_bytes = None
+        self._lock = threading.Lock()
+
+    def _encode(self, purpose):
+        with self._lock:
+            if purpose not in self._encoded:
+                if self.image is None:
+                    raise ValueError(f"Page {self.page_number} image was released before it was encoded for {purpose}")
+                data_url, stats = self.preprocessor.to_data_url(self.image, purpose, self.dpi)
+                if self.preprocessor.measure_savings:
+                    # Every request used to carry the same full PNG, so one baseline serves all purposes
+                    if self._baseline_bytes is None:
+                        self._baseline_bytes = self.preprocessor.baseline_bytes(self.image)
+                    stats["baseline_bytes"] = self._baseline_bytes
+                    stats["bytes_saved"] = self._baseline_bytes - stats["encoded_bytes"]
+                self._encoded[purpose] = data_url, stats
+            return self._encoded[purpose]
+
+    def data_url(self, purpose="extract"):
+        """Base64 data URL of the preprocessed page"""
+        return self._encode(purpose)[0]
+
+    def stats(self, purpose="extract"):
+        """Encoding stats of the preprocessed page"""
+        return self._encode(purpose)[1]
+
+    def byte_size(self, purpose="extract"):
+        """Size in bytes of the encoded page image"""
+        return self.stats(purpose)["encoded_bytes"]
+
+    def is_encoded(self, purpose="extract"):
+        return purpose in self._encoded
+
+    def release(self):
+        """Drop the rendered image and keep only the encoded data URLs"""
+        self.image = None
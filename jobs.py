@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import uuid
+import threading
+import dotenv
+from concurrent.futures import ThreadPoolExecutor
+from sqlite_db import connect, enable_wal
+
+# Load environment variables from .env file if it exists
+dotenv.load_dotenv()
+
+# Job queue configuration
+JOB_DATA_DIR = os.getenv("JOB_DATA_DIR", "jobs")  # Holds the job database and queued PDFs
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # PDFs processed at the same time
+JOB_QUEUE_DEPTH = int(os.getenv("JOB_QUEUE_DEPTH", "20"))  # Jobs allowed to wait for a worker
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity"""
+
+
+class JobStore:
+    """SQLite-backed store of jobs and their per-page results"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        enable_wal(self.path)
+        with connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, filename TEXT, pdf_path TEXT, status TEXT NOT NULL, "
+                "page_count INTEGER, pages_done INTEGER NOT NULL DEFAULT 0, "
+                "api_response TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_pages ("
+                "job_id TEXT NOT NULL, page_number INTEGER NOT NULL, result TEXT NOT NULL, "
+                "PRIMARY KEY (job_id, page_number))"
+            )
+
+    def create(self, job_id, filename, pdf_path):
+        now = time.time()
+        with connect(self.path) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, filename, pdf_path, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, filename, pdf_path, QUEUED, now, now)
+            )
+
+    def update(self, job_id, **fields):
+        if "api_response" in fields:
+            fields["api_response"] = json.dumps(fields["api_response"], ensure_ascii=False)
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with connect(self.path) as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def add_page_result(self, job_id, page_number, result):
+        with connect(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO job_pages (job_id, page_number, result) VALUES (?, ?, ?)",
+                (job_id, page_number, json.dumps(result, ensure_ascii=False))
+            )
+            # A grouped result covers every page in its "pages" list
+            conn.execute(
+                "UPDATE jobs SET pages_done = (SELECT COALESCE(SUM(COALESCE(json_array_length(result, '$.pages'), 1)), 0) "
+                "FROM job_pages WHERE job_id = ?), updated_at = ? WHERE id = ?",
+                (job_id, time.time(), job_id)
+            )
+
+    def get(self, job_id):
+        """Job status as a dict, or None if the job does not exist"""
+        with connect(self.path) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        job["api_response"] = json.loads(job["api_response"]) if job["api_response"] else None
+        return job
+
+    def get_page_results(self, job_id):
+        """Per-page results finished so far, in page order"""
+        with connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT page_number, result FROM job_pages WHERE job_id = ? ORDER BY page_number", (job_id,)
+            ).fetchall()
+        return [{"page": row["page_number"], **json.loads(row["result"])} for row in rows]
+
+    def clear_page_results(self, job_id):
+        with connect(self.path) as conn:
+            conn.execute("DELETE FROM job_pages WHERE job_id = ?", (job_id,))
+            conn.execute("UPDATE jobs SET pages_done = 0 WHERE id = ?", (job_id,))
+
+    def unfinished(self):
+        """Ids of jobs that were queued or running, oldest first"""
+        with connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+
+class JobManager:
+    """Runs PDF processing jobs on a bounded background worker pool"""
+
+    def __init__(self, processor, data_dir=None, workers=None, queue_depth=None):
+        self.processor = processor
+        self.data_dir = data_dir or JOB_DATA_DIR
+        self.workers = workers or JOB_WORKERS
+        self.queue_depth = JOB_QUEUE_DEPTH if queue_depth is None else queue_depth
+        self.pdf_dir = os.path.join(self.data_dir, "pdfs")
+        os.makedirs(self.pdf_dir, exist_ok=True)
+        self.store = JobStore(os.path.join(self.data_dir, "jobs.sqlite3"))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pdf-job")
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self):
+        return self.workers + self.queue_depth
+
+    def _reserve(self, force=False):
+        with self._lock:
+            if not force and self._in_flight >= self.capacity:
+                raise QueueFullError(f"Job queue is full ({self._in_flight} jobs queued or running)")
+            self._in_flight += 1
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def submit(self, filename, upload_path):
+        """Take over an uploaded PDF and queue it for processing, returning the job id"""
+        # The upload is moved into the job directory, or removed if the job cannot be queued
+        try:
+            self._reserve()
+        except QueueFullError:
+            os.unlink(upload_path)
+            raise
+        job_id = uuid.uuid4().hex
+        pdf_path = os.path.join(self.pdf_dir, f"{job_id}.pdf")
+        try:
+            os.replace(upload_path, pdf_path)
+            self.store.create(job_id, filename, pdf_path)
+            self.executor.submit(self._run, job_id)
+            return job_id
+        except Exception:
+            self._release()
+            for path in (upload_path, pdf_path):
+                if os.path.exists(path):
+                    os.unlink(path)
+            raise
+
+    def recover(self):
+        """Requeue jobs that were queued or running when the server stopped"""
+        job_ids = self.store.unfinished()
+        for job_id in job_ids:
+            # Recovered jobs are always accepted, even beyond the queue depth
+            self._reserve(force=True)
+            self.store.update(job_id, status=QUEUED)
+            self.executor.submit(self._run, job_id)
+        if job_ids:
+            print(f"Requeued {len(job_ids)} unfinished job(s)")
+
+    def _run(self, job_id):
+        try:
+            job = self.store.get(job_id)
+            if not job["pdf_path"] or not os.path.exists(job["pdf_path"]):
+                self.store.update(job_id, status=FAILED, error="Uploaded PDF is no longer available")
+                return
+
+            # Pages from an interrupted run are processed again, mostly from the result cache
+            self.store.clear_page_results(job_id)
+            try:
+                page_count = self.processor.get_page_count(job["pdf_path"])
+            except Exception:
+                page_count = None
+            self.store.update(job_id, status=RUNNING, page_count=page_count)
+
+            results, api_response = self.processor.process_pdf(
+                job["pdf_path"],
+                send_to_api=True,
+                on_page_result=lambda page_number, result: self.store.add_page_result(job_id, page_number, result)
+            )
+            if page_count is None:
+                # Grouped results hold one entry per document, so the pages they cover are counted
+                page_count = sum(len(result.get("pages", [None])) for result in results)
+            self.store.update(job_id, status=COMPLETED, page_count=page_count, api_response=api_response)
+            os.unlink(job["pdf_path"])
+        except Exception as e:
+            print(f"Job {job_id} failed: {str(e)}")
+            self.store.update(job_id, status=FAILED, error=str(e))
+            pdf_path = os.path.join(self.pdf_dir, f"{job_id}.pdf")
+            if os.path.exists(pdf_path):
+                os.unlink(pdf_path)
+        finally:
+            self._release()
+
+    def status(self, job_id):
+        """Job status and progress, or None if the job does not exist"""
+        job = self.store.get(job_id)
+        if not job:
+            return None
+        return {
+            "job_id": job["id"],
+            "filename": job["filename"],
+            "status": job["status"],
+            "page_count": job["page_count"],
+            "pages_done": job["pages_done"],
+            "error": job["error"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+        }
+
+    def results(self, job_id):
+        """Job status with the page results finished so far, or None if the job does not exist"""
+        status = self.status(job_id)
+        if not status:
+            return None
+        job = self.store.get(job_id)
+        status["extracted_data"] = self.store.get_page_results(job_id)
+        status["api_response"] = job["api_response"]
+        return status
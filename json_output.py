@@ -0,0 +1,302 @@
+import os
+import re
+import json
+import decimal
+import dotenv
+
+# Load environment variables from .env file if it exists
+dotenv.load_dotenv()
+
+# Structured output configuration
+# Ask Azure OpenAI for output that follows the JSON schema of the document type
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "True").lower() == "true"
+# Follow-up requests for the rest of a response that was cut off by max_tokens
+MAX_CONTINUATIONS = int(os.getenv("MAX_CONTINUATIONS", "2"))
+
+CONTINUE_PROMPT = "Your previous reply was cut off. Continue the JSON exactly where it stopped, without repeating anything and without any explanation."
+
+
+def _object(fields, **properties):
+    """Strict-mode JSON schema object whose listed fields are nullable strings"""
+    properties = {**{field: {"type": ["string", "null"]} for field in fields}, **properties}
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+INVOICE_SCHEMA = _object(
+    ["vendor_name", "address", "invoice_no", "invoice_name", "date", "total_quantity", "total_amount"],
+    items={"type": "array", "items": _object(["order", "description", "quantity", "unit_price", "amount"])},
+)
+PACKING_LIST_SCHEMA = _object(
+    ["vendor_name", "packing_list_no", "packing_list_name", "address", "shipping_date",
+     "total_net_weight", "total_gross_weight", "total_measurement", "final_item_name"],
+    items={"type": "array", "items": _object(["no", "order", "description", "quantity", "net_weight", "gross_weight", "measurement"])},
+)
+COMBINED_SCHEMA = _object(
+    [],
+    type={"type": "string", "enum": ["invoice", "packing_list"]},
+    data={"anyOf": [INVOICE_SCHEMA, PACKING_LIST_SCHEMA]},
+)
+# Keyed by document type, None for combined classification and extraction
+OUTPUT_SCHEMAS = {"invoice": INVOICE_SCHEMA, "packing_list": PACKING_LIST_SCHEMA, None: COMBINED_SCHEMA}
+
+# Part of the result cache key, so changing a schema invalidates cached results
+SCHEMA_VERSION = json.dumps([STRUCTURED_OUTPUT, INVOICE_SCHEMA, PACKING_LIST_SCHEMA], sort_keys=True)
+
+# Fields holding a number followed by a unit ("160 PCS", "124 KGS", "0.23 CBM") or a currency amount ("US$6.00")
+QUANTITY_FIELDS = {
+    "invoice": {"total_quantity", "quantity"},
+    "packing_list": {"quantity", "net_weight", "gross_weight", "measurement",
+                     "total_net_weight", "total_gross_weight", "total_measurement"},
+}
+AMOUNT_FIELDS = {
+    "invoice": {"total_amount", "unit_price", "amount"},
+    "packing_list": set(),
+}
+
+# (item field, document total) pairs whose item values should add up to the total
+TOTAL_FIELDS = {
+    "invoice": [("quantity", "total_quantity"), ("amount", "total_amount")],
+    "packing_list": [("net_weight", "total_net_weight"), ("gross_weight", "total_gross_weight"),
+                     ("measurement", "total_measurement")],
+}
+# Allowed difference between the item sum and the total, relative to the total
+TOTAL_TOLERANCE = 0.001
+# Problems a sharper rendering may fix. Totals that do not add up are normal for one page of a longer
+# table and for invoices whose total includes tax or freight, so they are reported but not re-rendered.
+RERENDER_PROBLEMS = {"missing_fields", "unparsable_number"}
+
+QUANTITY_PATTERN = re.compile(r"^\s*(-?\d[\d,]*(?:\.\d+)?)\s*([A-Za-z]+\.?)?(.*)$", re.DOTALL)
+# Only amounts that state US dollars are rewritten; a bare "$" may be SGD, HKD or AUD
+AMOUNT_PATTERN = re.compile(r"^\s*(US\s*\$|USD)?\s*(-?\d[\d,]*(?:\.\d+)?)\s*(USD)?\s*$", re.IGNORECASE)
+# Quantities as checked: units may contain digits or superscripts ("1.5 M3", "0.5m\u00b3"), and a second
+# quantity or a note may follow ("160 PCS/ 8 CTNS", "12 pcs (12*5ctn)")
+CHECK_QUANTITY_PATTERN = re.compile(r"^\s*(-?\d[\d,]*(?:\.\d+)?)\s*([A-Za-z][A-Za-z0-9\u00b2\u00b3]*\.?)?\s*([(/,].*)?$", re.DOTALL)
+# Values that stand for "no value" rather than a misread number
+PLACEHOLDER_PATTERN = re.compile(r"^\s*(?:N/?A|NIL|NONE|NULL|TBA|TBD|[-\u2013\u2014/.*]+)\s*$", re.IGNORECASE)
+# Any currency code or symbol, for checking amounts that normalize_amount leaves alone
+ANY_AMOUNT_PATTERN = re.compile(r"^\s*(?:[A-Za-z]{1,3}\s*)?[$\u20ac\u00a3\u00a5]?\s*(-?\d[\d,]*(?:\.\d+)?)\s*(?:[A-Za-z]{3})?\s*$")
+
+
+def response_format(doc_type):
+    """response_format parameter constraining the output to a document type's schema"""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": doc_type or "document", "strict": True, "schema": OUTPUT_SCHEMAS[doc_type]},
+    }
+
+
+def strip_fences(text):
+    """Remove markdown code fences and any text around the JSON"""
+    text = text.strip()
+    fenced = re.match(r"^```[a-zA-Z]*\s*\n?(.*?)(?:\n?```\s*)?$", text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1).strip()
+    starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+    if not starts:
+        return text
+    text = text[min(starts):]
+    # Complete JSON ends where the decoder stops, which drops a closing fence or remark after it.
+    # Truncated JSON is returned as it is for close_truncated_json.
+    try:
+        _, end = json.JSONDecoder().raw_decode(text)
+    except json.JSONDecodeError:
+        return text
+    return text[:end]
+
+
+def strip_continuation_fences(text):
+    """Remove code fences the model may put around a continuation fragment"""
+    text = re.sub(r"^\s*```[a-zA-Z]*[ \t]*\n?", "", text or "")
+    return re.sub(r"\n?```\s*$", "", text)
+
+
+def close_truncated_json(text):
+    """Complete JSON that was cut off, dropping the unfinished value and closing open arrays and objects"""
+    # Open containers as (closing character, start index)
+    stack = []
+    in_string = escape = False
+    expect_key = False
+    last_comma = None
+    # Index just past the last string value or container that was completed
+    value_end = None
+    for index, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+                if not (stack and stack[-1][0] == "}" and expect_key):
+                    value_end = index + 1
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append(("}" if char == "{" else "]", index))
+            expect_key = char == "{"
+        elif char in "}]":
+            if stack:
+                stack.pop()
+            value_end = index + 1
+        elif char == ":":
+            expect_key = False
+        elif char == ",":
+            # Everything before the last comma is complete
+            last_comma = (index, list(stack))
+            expect_key = bool(stack) and stack[-1][0] == "}"
+
+    if not stack and not in_string:
+        return text
+    if len(stack) >= 2 and stack[-1][0] == "}" and stack[-2][0] == "]":
+        # An unfinished table row is dropped entirely rather than kept with missing fields
+        cut, open_containers = stack[-1][1], stack[:-1]
+    elif not in_string and value_end is not None and text[value_end:].strip() in ("", ","):
+        # The cut came right after a complete value, which is kept. Numbers and literals at the
+        # end may themselves be cut short, so they are dropped.
+        cut, open_containers = value_end, stack
+    elif last_comma is not None:
+        cut, open_containers = last_comma
+    else:
+        return None
+    return text[:cut].rstrip().rstrip(",") + "".join(closer for closer, _ in reversed(open_containers))
+
+
+def parse_json_output(text):
+    """Parse model output into JSON, returning (data, list of repairs applied)"""
+    # Raises json.JSONDecodeError if the output cannot be repaired
+    repairs = []
+    cleaned = strip_fences(text or "")
+    if cleaned != (text or "").strip():
+        repairs.append("fences")
+    try:
+        return json.loads(cleaned), repairs
+    except json.JSONDecodeError as e:
+        closed = close_truncated_json(cleaned)
+        if not closed or closed == cleaned:
+            raise
+        try:
+            return json.loads(closed), repairs + ["truncated"]
+        except json.JSONDecodeError:
+            raise e
+
+
+def plain_number(value):
+    """A number in plain notation: 124.0 -> '124', 1e-05 -> '0.00001'"""
+    if float(value).is_integer():
+        return str(int(value))
+    return format(decimal.Decimal(repr(value)), "f")
+
+
+def normalize_quantity(value):
+    """'160 pcs' -> '160 PCS' and 124 -> '124', keeping a note in brackets after the unit"""
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return plain_number(value)
+    match = QUANTITY_PATTERN.match(str(value))
+    if not match:
+        return value
+    number, unit, rest = match.groups()
+    # Only a trailing note in brackets is kept, e.g. '12 pcs (12*5ctn)'; anything else is left as it was
+    if rest.strip() and not rest.strip().startswith("("):
+        return value
+    normalized = f"{number} {unit.upper()}" if unit else number
+    return f"{normalized} {rest.strip()}" if rest.strip() else normalized
+
+
+def normalize_amount(value):
+    """'US$ 6', 'USD 6' and '6.00 USD' -> 'US$6.00', and 6 -> '6'; any other currency or a bare '$' is left alone"""
+    # A plain number does not say which currency it is in, so none is added
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return plain_number(value)
+    match = AMOUNT_PATTERN.match(str(value))
+    if not match:
+        return value
+    prefix, number, suffix = match.groups()
+    if not (prefix or suffix):
+        return value.strip()
+    # The digits are kept as written, with at least two decimals
+    whole, _, fraction = number.partition(".")
+    return f"US${whole}.{fraction.ljust(2, '0')}"
+
+
+def normalize_document(doc_type, data):
+    """Normalize the typed numeric fields of an extracted invoice or packing list in place"""
+    # With doc_type None, data is a combined {"type": ..., "data": ...} response
+    if doc_type is None:
+        if isinstance(data, dict) and data.get("type") in QUANTITY_FIELDS and isinstance(data.get("data"), dict):
+            normalize_document(data["type"], data["data"])
+        return data
+    if not isinstance(data, dict):
+        return data
+
+    rows = [data] + [item for item in data.get("items") or [] if isinstance(item, dict)]
+    for row in rows:
+        for field in QUANTITY_FIELDS.get(doc_type, ()):
+            if field in row:
+                row[field] = normalize_quantity(row[field])
+        for field in AMOUNT_FIELDS.get(doc_type, ()):
+            if field in row:
+                row[field] = normalize_amount(row[field])
+    return data
+
+
+def parse_number(value, field_kind="quantity"):
+    """(number, unit) of a quantity or amount field, None if empty, raising ValueError if it holds no readable number"""
+    # Placeholders such as "N/A" or "-" count as empty
+    if value is None or isinstance(value, bool) or (isinstance(value, str) and not value.strip()):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value), None
+    if PLACEHOLDER_PATTERN.match(str(value)):
+        return None
+    if field_kind == "amount":
+        match = ANY_AMOUNT_PATTERN.match(str(value))
+        if not match:
+            raise ValueError(value)
+        return float(match.group(1).replace(",", "")), None
+    match = CHECK_QUANTITY_PATTERN.match(str(value))
+    if not match:
+        raise ValueError(value)
+    number, unit, _ = match.groups()
+    unit = unit.upper().rstrip(".").replace("\u00b3", "3").replace("\u00b2", "2") if unit else None
+    return float(number.replace(",", "")), unit
+
+
+def check_document(doc_type, data):
+    """Problems with an extracted document that suggest the page was misread, as (kind, message) pairs"""
+    # kind is "missing_fields", "unparsable_number" or "totals_mismatch". Empty fields are not problems,
+    # since a page can legitimately lack a value.
+    if doc_type not in OUTPUT_SCHEMAS or not isinstance(data, dict):
+        return [("missing_fields", "extracted data is not a document")]
+    problems = []
+    missing = [field for field in OUTPUT_SCHEMAS[doc_type]["required"] if field not in data]
+    if missing:
+        problems.append(("missing_fields", f"missing field(s) {', '.join(missing)}"))
+    items = [item for item in data.get("items") or [] if isinstance(item, dict)]
+
+    numbers = {}
+    for field in QUANTITY_FIELDS[doc_type] | AMOUNT_FIELDS[doc_type]:
+        field_kind = "amount" if field in AMOUNT_FIELDS[doc_type] else "quantity"
+        for index, row in enumerate([data] + items):
+            try:
+                numbers[(index, field)] = parse_number(row.get(field), field_kind)
+            except ValueError:
+                location = f"item {index}" if index else "document"
+                problems.append(("unparsable_number", f"unreadable {field} {row.get(field)!r} in {location}"))
+
+    for item_field, total_field in TOTAL_FIELDS[doc_type]:
+        total = numbers.get((0, total_field))
+        values = [numbers.get((index, item_field)) for index in range(1, len(items) + 1)]
+        values = [value for value in values if value is not None]
+        if not total or not values:
+            continue
+        # Values in a different unit from the total, such as PCS and SETS, are not summed
+        if any(unit and total[1] and unit != total[1] for _, unit in values):
+            continue
+        item_sum = sum(number for number, _ in values)
+        if abs(item_sum - total[0]) > max(0.01, abs(total[0]) * TOTAL_TOLERANCE):
+            problems.append(("totals_mismatch", f"items add up to {item_sum:g} {item_field}, not {total_field} {data.get(total_field)}"))
+    return problems
@@ -0,0 +1,248 @@
+import time
+import bisect
+import threading
+import contextlib
+import contextvars
+
+# Histogram buckets
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)  # Seconds
+BYTES_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 512 * 1024, 1024 ** 2, 2 * 1024 ** 2, 4 * 1024 ** 2)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in sorted(values.items())]
+
+
+class Histogram:
+    """Cumulative bucket histogram with optional labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        samples = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                samples.append((f"{self.name}_bucket", _format_labels(self.labelnames, key, [("le", le)]), cumulative))
+            samples.append((f"{self.name}_sum", _format_labels(self.labelnames, key), total))
+            samples.append((f"{self.name}_count", _format_labels(self.labelnames, key), cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """Process-wide collection of metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets, labelnames=()):
+        metric = Histogram(name, help_text, buckets, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "invoice_stage_duration_seconds", "Time spent in each pipeline stage", DURATION_BUCKETS, ("stage",))
+IMAGE_BYTES = REGISTRY.histogram(
+    "invoice_image_payload_bytes", "Size of encoded page images sent to the model", BYTES_BUCKETS, ("purpose",))
+MODEL_TOKENS = REGISTRY.counter(
+    "invoice_model_tokens_total", "Tokens reported in Azure OpenAI usage blocks", ("kind",))
+HTTP_RETRIES = REGISTRY.counter(
+    "invoice_http_retries_total", "Retried HTTP requests", ("target",))
+CACHE_LOOKUPS = REGISTRY.counter(
+    "invoice_cache_lookups_total", "Result cache lookups", ("level", "result"))
+STAGE_CPU_SECONDS = REGISTRY.counter(
+    "invoice_stage_cpu_seconds_total", "CPU time of the thread running each pipeline stage", ("stage",))
+OUTPUT_FIXES = REGISTRY.counter(
+    "invoice_output_fixes_total", "Model replies that were continued or repaired locally", ("kind",))
+CLASSIFICATIONS = REGISTRY.counter(
+    "invoice_classifications_total", "Page classifications by source: text keywords, template index or model", ("source",))
+DPI_ESCALATIONS = REGISTRY.counter(
+    "invoice_dpi_escalated_pages_total", "Pages whose draft extraction failed validation and was repeated at full DPI",
+    ("reason", "resolved"))
+PAGES = REGISTRY.counter(
+    "invoice_pages_total", "Processed pages", ("status",))
+
+# Timings of the job the current thread is working on
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class JobTimings:
+    """Per-job totals of stage times, payload sizes, tokens, retries and cache hits"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, seconds, cpu_seconds=0.0):
+        with self._lock:
+            count, total, cpu_total = self.stages.get(stage, (0, 0.0, 0.0))
+            self.stages[stage] = (count + 1, total + seconds, cpu_total + cpu_seconds)
+
+    def add(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """JSON-serializable summary of the job so far"""
+        with self._lock:
+            stages = {
+                stage: {"count": count, "seconds": round(total, 3), "cpu_seconds": round(cpu_total, 3)}
+                for stage, (count, total, cpu_total) in self.stages.items()
+            }
+            counters = dict(self.counters)
+        return {"elapsed_seconds": round(time.perf_counter() - self.started, 3), "stages": stages, **counters}
+
+
+@contextlib.contextmanager
+def track_job(timings):
+    """Attribute the metrics recorded inside the block to a JobTimings"""
+    token = _current_job.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_job.reset(token)
+
+
+def _job_add(name, value=1):
+    timings = _current_job.get()
+    if timings is not None:
+        timings.add(name, value)
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """Record the duration and CPU time of the block as a pipeline stage"""
+    # Thread CPU time excludes subprocesses such as poppler's pdftocairo
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        cpu_seconds = time.thread_time() - cpu_start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        STAGE_CPU_SECONDS.inc(cpu_seconds, stage=stage)
+        timings = _current_job.get()
+        if timings is not None:
+            timings.add_stage(stage, elapsed, cpu_seconds)
+
+
+def record_image_bytes(purpose, size, saved=None):
+    # saved is the difference from a PNG of the rendered page, when it was measured
+    IMAGE_BYTES.observe(size, purpose=purpose)
+    _job_add("image_bytes", size)
+    if saved is not None:
+        _job_add("image_bytes_saved", saved)
+
+
+def record_usage(usage):
+    """Record the usage block of a chat completion response"""
+    if not isinstance(usage, dict):
+        return
+    for kind in ("prompt", "completion"):
+        tokens = usage.get(f"{kind}_tokens") or 0
+        MODEL_TOKENS.inc(tokens, kind=kind)
+        _job_add(f"{kind}_tokens", tokens)
+
+
+def record_retries(target, retries):
+    if retries:
+        HTTP_RETRIES.inc(retries, target=target)
+        _job_add("retries", retries)
+
+
+def record_cache_lookup(level, hit):
+    CACHE_LOOKUPS.inc(level=level, result="hit" if hit else "miss")
+    _job_add(f"{level}_cache_hits" if hit else f"{level}_cache_misses")
+
+
+def record_output_fix(kind):
+    OUTPUT_FIXES.inc(kind=kind)
+    _job_add(f"output_{kind}")
+
+
+def record_classification(source):
+    CLASSIFICATIONS.inc(source=source)
+    _job_add(f"classified_by_{source}")
+
+
+def record_escalation(reason, resolved, pages=1):
+    DPI_ESCALATIONS.inc(pages, reason=reason, resolved="true" if resolved else "false")
+    _job_add("dpi_escalated_pages", pages)
+    if resolved:
+        _job_add("dpi_escalations_resolved", pages)
+
+
+def record_page(ok):
+    PAGES.inc(status="ok" if ok else "error")
+    _job_add("pages")
+    if not ok:
+        _job_add("failed_pages")
@@ -0,0 +1,175 @@
+import os
+import re
+import time
+import threading
+import dotenv
+from PIL import Image
+from sqlite_db import connect, enable_wal
+
+# Load environment variables from .env file if it exists
+dotenv.load_dotenv()
+
+# Local classifier configuration
+LOCAL_CLASSIFIER_ENABLED = os.getenv("LOCAL_CLASSIFIER_ENABLED", "True").lower() == "true"
+# Confidence needed to skip the model's classification, between 0 and 1
+CLASSIFIER_MIN_CONFIDENCE = float(os.getenv("CLASSIFIER_MIN_CONFIDENCE", "0.8"))
+CLASSIFIER_INDEX_PATH = os.getenv("CLASSIFIER_INDEX_PATH", "page_index.sqlite3")
+# Largest share of differing hash bits at which two pages count as the same template
+PHASH_MAX_DISTANCE = float(os.getenv("PHASH_MAX_DISTANCE", "0.25"))
+CLASSIFIER_INDEX_MAX_ENTRIES = int(os.getenv("CLASSIFIER_INDEX_MAX_ENTRIES", "5000"))
+
+HASH_SIZE = 16  # 16x16 horizontal and vertical edges, 512 bits
+# Grey level difference between neighbouring cells that counts as an edge
+EDGE_THRESHOLD = 8
+# Hashes of nearly blank pages have too few set bits to tell templates apart
+MIN_HASH_BITS = 16
+
+# Weighted text layer keywords. "Invoice No." on a packing list does not count towards invoice.
+KEYWORDS = {
+    "invoice": [
+        (r"\bINVOICE\b(?!\s*(?:NO\b|NUMBER\b|#|:))", 4),
+        (r"\bUNIT\s+PRICE\b", 3),
+        (r"\bTOTAL\s+AMOUNT\b", 2),
+        (r"\bAMOUNT\b", 1),
+        (r"US\$|\bUSD\b", 1),
+        (r"\bPAYMENT\b|\bBENEFICIARY\b|\bBANK\b", 1),
+    ],
+    "packing_list": [
+        (r"\bPACKING\s+LIST\b", 5),
+        (r"\bN\.\s?W\.|\bNET\s+W(?:EIGH)?T\b", 2),
+        (r"\bG\.\s?W\.|\bGROSS\s+W(?:EIGH)?T\b", 2),
+        (r"\bMEASUREMENT\b|\bCBM\b", 2),
+        (r"\bKGS?\b", 1),
+        (r"\bCTNS?\b|\bCARTONS?\b|\bPALLETS?\b", 1),
+    ],
+}
+# Minimum keyword score of the winning type for a text decision
+MIN_KEYWORD_SCORE = 4
+
+
+def difference_hash(image, hash_size=HASH_SIZE):
+    """Perceptual hash of a page's layout as an integer, robust to resolution and compression"""
+    # Each bit marks an edge between neighbouring cells of a downscaled page, in either direction,
+    # so both sides of a printed block or table are captured
+    width = hash_size + 1
+    pixels = list(image.convert("L").resize((width, width), Image.BOX).getdata())
+    bits = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            cell = pixels[row * width + column]
+            right = pixels[row * width + column + 1]
+            below = pixels[(row + 1) * width + column]
+            bits = (bits << 2) | (abs(cell - right) > EDGE_THRESHOLD) << 1 | (abs(cell - below) > EDGE_THRESHOLD)
+    return bits
+
+
+def hash_distance(a, b):
+    """Share of differing bits among the bits set in either hash"""
+    # Pages are mostly white background, which has no edge bits, so a plain Hamming
+    # distance would make any two sparse pages look alike
+    return bin(a ^ b).count("1") / max(1, bin(a | b).count("1"))
+
+
+def is_informative(page_hash):
+    return bin(page_hash).count("1") >= MIN_HASH_BITS
+
+
+def keyword_scores(text):
+    """Keyword score of a page's text for each document type"""
+    upper = text.upper()
+    return {
+        doc_type: sum(weight * len(re.findall(pattern, upper)[:3]) for pattern, weight in patterns)
+        for doc_type, patterns in KEYWORDS.items()
+    }
+
+
+def classify_text(text):
+    """(document type, confidence) from text layer keywords, or (None, 0.0)"""
+    if not text:
+        return None, 0.0
+    scores = keyword_scores(text)
+    (winner, best), (_, runner_up) = sorted(scores.items(), key=lambda item: -item[1])
+    if best < MIN_KEYWORD_SCORE:
+        return None, 0.0
+    return winner, (best - runner_up) / (best + runner_up)
+
+
+class PageClassifier:
+    """Local invoice / packing list classifier using text keywords and an index of known page templates"""
+
+    def __init__(self, index_path=None, min_confidence=None, max_distance=None, max_entries=None):
+        self.index_path = index_path or CLASSIFIER_INDEX_PATH
+        self.min_confidence = CLASSIFIER_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self.max_distance = PHASH_MAX_DISTANCE if max_distance is None else max_distance
+        self.max_entries = CLASSIFIER_INDEX_MAX_ENTRIES if max_entries is None else max_entries
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        enable_wal(self.index_path)
+        with connect(self.index_path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS page_hashes ("
+                "hash TEXT NOT NULL, doc_type TEXT NOT NULL, created_at REAL NOT NULL, "
+                "PRIMARY KEY (hash, doc_type))"
+            )
+            rows = conn.execute(
+                "SELECT hash, doc_type FROM page_hashes ORDER BY created_at DESC LIMIT ?", (self.max_entries or -1,)
+            ).fetchall()
+        # The index is small, so lookups scan an in-memory copy
+        self._hashes = [(int(page_hash, 16), doc_type) for page_hash, doc_type in rows]
+
+    def classify_image(self, image):
+        """(document type, confidence) from the nearest known page templates, or (None, 0.0)"""
+        page_hash = difference_hash(image)
+        if not is_informative(page_hash):
+            return None, 0.0
+        with self._lock:
+            matches = [(hash_distance(page_hash, known), doc_type) for known, doc_type in self._hashes]
+        matches = [(distance, doc_type) for distance, doc_type in matches if distance <= self.max_distance]
+        if not matches:
+            return None, 0.0
+        # Every template within range votes, closer ones counting more
+        votes = {}
+        for distance, doc_type in matches:
+            votes[doc_type] = votes.get(doc_type, 0.0) + 1 - distance / (self.max_distance * 2)
+        winner = max(votes, key=votes.get)
+        return winner, votes[winner] / sum(votes.values())
+
+    def classify(self, text=None, image=None):
+        """(document type, confidence, source) for a page, or (None, 0.0, None) when undecided"""
+        # Text keywords are tried first, then the template index
+        doc_type, confidence = classify_text(text)
+        if doc_type and confidence >= self.min_confidence:
+            return doc_type, confidence, "text"
+        if image is not None:
+            doc_type, confidence = self.classify_image(image)
+            if doc_type and confidence >= self.min_confidence:
+                return doc_type, confidence, "phash"
+        return None, 0.0, None
+
+    def learn(self, image, doc_type):
+        """Add a page whose type is known to the template index"""
+        page_hash = difference_hash(image)
+        if not is_informative(page_hash):
+            return
+        with self._lock:
+            if (page_hash, doc_type) in self._hashes:
+                return
+            self._hashes.insert(0, (page_hash, doc_type))
+            if self.max_entries:
+                del self._hashes[self.max_entries:]
+        with connect(self.index_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO page_hashes (hash, doc_type, created_at) VALUES (?, ?, ?)",
+                (format(page_hash, "x"), doc_type, time.time())
+            )
+            if self.max_entries:
+                conn.execute(
+                    "DELETE FROM page_hashes WHERE rowid IN ("
+                    "SELECT rowid FROM page_hashes ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+
+    def size(self):
+        with self._lock:
+            return len(self._hashes)
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import dotenv
+from sqlite_db import connect, enable_wal
+
+# Load environment variables from .env file if it exists
+dotenv.load_dotenv()
+
+# Result cache configuration
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "True").lower() == "true"
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "result_cache.sqlite3")
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))  # Seconds, 0 disables expiry
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))  # Per table, 0 disables the limit
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_image(image):
+    """SHA-256 of the pixel data of a PIL Image"""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def hash_text(text):
+    """SHA-256 of a page's text layer"""
+    return hashlib.sha256(f"text:{text}".encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """SQLite-backed cache of extraction results keyed by document and page content hashes"""
+
+    TABLES = ("documents", "pages")
+
+    def __init__(self, path=None, ttl=None, max_entries=None):
+        self.path = path or RESULT_CACHE_PATH
+        self.ttl = RESULT_CACHE_TTL if ttl is None else ttl
+        self.max_entries = RESULT_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        enable_wal(self.path)
+        with connect(self.path) as conn:
+            for table in self.TABLES:
+                conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                    "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed_at ON {table} (accessed_at)")
+
+    @staticmethod
+    def make_key(content_hash, namespace):
+        """Combine a content hash with the model/prompt/API namespace"""
+        return hashlib.sha256(f"{namespace}|{content_hash}".encode("utf-8")).hexdigest()
+
+    def _get(self, table, key):
+        now = time.time()
+        with connect(self.path) as conn:
+            row = conn.execute(f"SELECT value, created_at FROM {table} WHERE key = ?", (key,)).fetchone()
+            if row and self.ttl and now - row[1] > self.ttl:
+                conn.execute(f"DELETE FROM {table} WHERE key = ?", (key,))
+                row = None
+            if row:
+                conn.execute(f"UPDATE {table} SET accessed_at = ? WHERE key = ?", (now, key))
+
+        with self._lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return json.loads(row[0]) if row else None
+
+    def _set(self, table, key, value):
+        now = time.time()
+        with connect(self.path) as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {table} (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self._evict(conn, table, now)
+
+    def _evict(self, conn, table, now):
+        """Drop expired entries and the least recently used entries beyond the size limit"""
+        if self.ttl:
+            conn.execute(f"DELETE FROM {table} WHERE created_at < ?", (now - self.ttl,))
+        if self.max_entries:
+            conn.execute(
+                f"DELETE FROM {table} WHERE key IN ("
+                f"SELECT key FROM {table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def get_document(self, key):
+        """Cached per-page results for a whole PDF, or None"""
+        return self._get("documents", key)
+
+    def set_document(self, key, results):
+        self._set("documents", key, results)
+
+    def get_page(self, key):
+        """Cached result for a single page, or None"""
+        return self._get("pages", key)
+
+    def set_page(self, key, result):
+        self._set("pages", key, result)
+
+    def stats(self):
+        """Hit/miss counters and current entry counts"""
+        with connect(self.path) as conn:
+            sizes = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in self.TABLES}
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, **sizes}
@@ -0,0 +1,30 @@
+import sqlite3
+import contextlib
+
+
+def enable_wal(path):
+    """Switch a database to write-ahead logging, so readers and the writer do not block each other"""
+    # The journal mode cannot be changed inside a transaction
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+    finally:
+        conn.close()
+
+
+@contextlib.contextmanager
+def connect(path, immediate=False):
+    """Short-lived connection that commits on success and is always closed"""
+    # immediate takes the write lock up front, so concurrent writers never claim the same rows
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
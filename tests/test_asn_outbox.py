@@ -0,0 +1,48 @@
+from asn_outbox import AsnOutbox, idempotency_key, SENT, PENDING
+
+
+def invoice(vendor, number, amount="100.00"):
+    return {"type": "invoice", "data": {"vendor_name": vendor, "invoice_no": number, "total_amount": amount}}
+
+
+def make_outbox(tmp_path, sent):
+    def send(payload, key):
+        sent.append(payload)
+        return True, {"status": "ok"}
+    outbox = AsnOutbox(send, path=str(tmp_path / "outbox.sqlite3"))
+    # Delivery is driven by the test instead of the background sender
+    outbox.start = lambda: None
+    return outbox
+
+
+def test_key_includes_vendor():
+    assert idempotency_key([invoice("ACME", "1001")]) != idempotency_key([invoice("Globex", "1001")])
+    assert idempotency_key([invoice("ACME Pte. Ltd.", "1001")]) == idempotency_key([invoice("acme pte ltd", "1001")])
+
+
+def test_same_number_from_another_vendor_is_delivered(tmp_path):
+    sent = []
+    outbox = make_outbox(tmp_path, sent)
+    outbox.enqueue([invoice("ACME", "1001")])
+    outbox.drain_once()
+    entry = outbox.enqueue([invoice("Globex", "1001")])
+    assert entry["status"] == PENDING
+    outbox.drain_once()
+    assert [payload[0]["data"]["vendor_name"] for payload in sent] == ["ACME", "Globex"]
+
+
+def test_resubmitting_sent_document(tmp_path):
+    sent = []
+    outbox = make_outbox(tmp_path, sent)
+    outbox.enqueue([invoice("ACME", "1001")])
+    outbox.drain_once()
+
+    entry = outbox.enqueue([invoice("ACME", "1001")])
+    assert entry["status"] == SENT
+    assert "conflict" not in entry
+
+    entry = outbox.enqueue([invoice("ACME", "1001", amount="250.00")])
+    assert entry["status"] == SENT
+    assert entry["conflict"] is True
+    outbox.drain_once()
+    assert len(sent) == 1
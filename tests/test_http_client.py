@@ -0,0 +1,225 @@
+import time
+import socket
+import threading
+import email.utils
+import pytest
+import requests
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from http_client import HttpClient, RateLimiter
+
+
+class StubServer:
+    """Local server answering each POST with the next scripted (status, headers) pair, then 200"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = 0
+        self.client_ports = []
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with server._lock:
+                    server.requests += 1
+                    server.client_ports.append(self.client_address[1])
+                    status, headers = server.responses.pop(0) if server.responses else (200, {})
+                body = b"{}"
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def closed_port_url():
+    """URL of a local port nothing listens on"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/"
+
+
+def make_client(**kwargs):
+    # No jitter, so the waits measured below come from the server hints alone
+    kwargs.setdefault("backoff_base", 0)
+    kwargs.setdefault("max_retries", 3)
+    return HttpClient(connect_timeout=2, read_timeout=5, **kwargs)
+
+
+def test_retry_after_seconds_is_honored():
+    with StubServer((429, {"Retry-After": "1"})) as server:
+        start = time.monotonic()
+        response = make_client().post(server.url, json={})
+        elapsed = time.monotonic() - start
+    assert response.status_code == 200
+    assert response.retry_count == 1
+    assert server.requests == 2
+    assert elapsed >= 1.0
+
+
+def test_retry_after_ms_takes_priority():
+    with StubServer((429, {"retry-after-ms": "200", "Retry-After": "30"})) as server:
+        start = time.monotonic()
+        response = make_client().post(server.url, json={})
+        elapsed = time.monotonic() - start
+    assert response.status_code == 200
+    assert response.retry_count == 1
+    assert 0.2 <= elapsed < 5
+
+
+def test_retry_after_http_date():
+    response = requests.Response()
+    response.headers["Retry-After"] = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 <= make_client().retry_after(response) <= 30
+    response.headers["Retry-After"] = "not a date"
+    assert make_client().retry_after(response) is None
+
+
+def test_retry_after_is_capped_by_backoff_max():
+    with StubServer((503, {"Retry-After": "120"})) as server:
+        start = time.monotonic()
+        response = make_client(backoff_max=0.1).post(server.url, json={})
+        elapsed = time.monotonic() - start
+    assert response.status_code == 200
+    assert elapsed < 5
+
+
+def test_gives_up_after_max_retries():
+    with StubServer(*[(503, {})] * 10) as server:
+        response = make_client(max_retries=2).post(server.url, json={})
+    assert response.status_code == 503
+    assert response.retry_count == 2
+    assert server.requests == 3
+
+
+def test_non_retryable_status_is_returned_at_once():
+    with StubServer((400, {})) as server:
+        response = make_client().post(server.url, json={})
+    assert response.status_code == 400
+    assert response.retry_count == 0
+    assert server.requests == 1
+
+
+def test_connection_error_is_raised_after_retries():
+    client = make_client(max_retries=1)
+    with pytest.raises(requests.ConnectionError):
+        client.post(closed_port_url(), json={})
+
+
+def test_connection_is_reused():
+    with StubServer() as server:
+        client = make_client()
+        for _ in range(5):
+            assert client.post(server.url, json={}).status_code == 200
+    assert server.requests == 5
+    assert len(set(server.client_ports)) == 1
+
+
+def test_rate_limiter_paces_requests():
+    # 600 requests per minute: the full bucket allows a burst, then one request every 0.1s
+    limiter = RateLimiter(requests_per_minute=600)
+    for _ in range(600):
+        limiter.acquire()
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+    elapsed = time.monotonic() - start
+    assert 0.25 <= elapsed < 1.0
+
+
+def test_rate_limiter_paces_tokens():
+    # 600 tokens per minute is 10 tokens per second once the bucket is spent
+    limiter = RateLimiter(tokens_per_minute=600)
+    limiter.acquire(600)
+    start = time.monotonic()
+    limiter.acquire(5)
+    elapsed = time.monotonic() - start
+    assert 0.45 <= elapsed < 1.0
+
+
+def test_client_waits_for_rate_limiter():
+    with StubServer() as server:
+        client = make_client(rate_limiter=RateLimiter(requests_per_minute=600))
+        for _ in range(600):
+            client.rate_limiter.acquire()
+        start = time.monotonic()
+        for _ in range(2):
+            client.post(server.url, json={})
+        elapsed = time.monotonic() - start
+    assert elapsed >= 0.15
+
+
+def test_non_idempotent_client_leaves_server_errors_to_the_caller():
+    with StubServer((503, {}), (502, {})) as server:
+        response = make_client(idempotent=False).post(server.url, json={})
+    assert response.status_code == 503
+    assert response.retry_count == 0
+    assert server.requests == 1
+
+
+def test_non_idempotent_client_retries_throttling():
+    with StubServer((429, {"retry-after-ms": "10"})) as server:
+        response = make_client(idempotent=False).post(server.url, json={})
+    assert response.status_code == 200
+    assert response.retry_count == 1
+
+
+def test_non_idempotent_client_retries_refused_connections(monkeypatch):
+    client = make_client(idempotent=False, max_retries=2)
+    attempts = []
+    post = client.session.post
+    monkeypatch.setattr(client.session, "post", lambda *args, **kwargs: attempts.append(1) or post(*args, **kwargs))
+    with pytest.raises(requests.ConnectionError):
+        client.post(closed_port_url(), json={})
+    assert len(attempts) == 3
+
+
+def test_non_idempotent_client_does_not_retry_read_timeouts():
+    class SlowHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            time.sleep(1)
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        client = HttpClient(connect_timeout=2, read_timeout=0.2, max_retries=3, backoff_base=0, idempotent=False)
+        start = time.monotonic()
+        with pytest.raises(requests.ReadTimeout):
+            client.post(f"http://127.0.0.1:{httpd.server_address[1]}/", json={})
+        assert time.monotonic() - start < 0.9
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
@@ -0,0 +1,50 @@
+from PIL import Image
+
+from http_client import estimate_image_tokens
+from image_preprocessing import ImagePreprocessor, PageImage, split_into_strips, MODEL_MAX_EDGE, MODEL_SHORT_EDGE
+
+
+def model_width(size):
+    """Width of an image after the model's own high-detail scaling"""
+    width, height = size
+    scale = min(1.0, MODEL_MAX_EDGE / max(width, height))
+    scale *= min(1.0, MODEL_SHORT_EDGE / (min(width, height) * scale))
+    return round(width * scale)
+
+
+def test_strips_cover_the_page_with_overlap():
+    image = Image.new("RGB", (2480, 3508), "white")
+    strips = split_into_strips(image)
+    assert len(strips) > 1
+    assert all(strip.width == image.width for strip in strips)
+    heights = [strip.height for strip in strips]
+    assert sum(heights) > image.height
+    assert heights[0] * len(strips) - image.height >= 0.1 * heights[0] * (len(strips) - 1)
+
+
+def test_short_page_is_one_strip():
+    image = Image.new("RGB", (2480, 600), "white")
+    assert split_into_strips(image) == [image]
+
+
+def test_strips_reach_the_model_sharper_than_a_whole_page():
+    # A 150 DPI draft and a 300 DPI rendering of a whole A4 page reach the model at the same size
+    default = ImagePreprocessor(target_dpi=200, max_edge=2048)
+    draft = PageImage(Image.new("RGB", (1240, 1754), "white"), 1, default, dpi=150)
+    full = PageImage(Image.new("RGB", (2480, 3508), "white"), 1, default, dpi=300)
+    assert model_width(draft.stats()["encoded_size"]) == model_width(full.stats()["encoded_size"]) == 768
+
+    detail = ImagePreprocessor(target_dpi=300, max_edge=MODEL_MAX_EDGE)
+    strip = PageImage(split_into_strips(full.image)[0], 1, detail, dpi=300)
+    encoded_size = strip.stats()["encoded_size"]
+    assert model_width(encoded_size) == 2048
+    assert estimate_image_tokens(*encoded_size) > estimate_image_tokens(*draft.stats()["encoded_size"])
+
+
+def test_savings_are_measured_against_a_png_of_the_rendered_page():
+    image = Image.effect_noise((400, 500), 64).convert("RGB")
+    page = PageImage(image, 1, ImagePreprocessor(image_format="JPEG", target_dpi=150, measure_savings=True), dpi=300)
+    stats = page.stats("extract")
+    assert stats["baseline_bytes"] == ImagePreprocessor().baseline_bytes(image)
+    assert stats["bytes_saved"] == stats["baseline_bytes"] - stats["encoded_bytes"] > 0
+    assert "bytes_saved" not in PageImage(image, 1, ImagePreprocessor(measure_savings=False)).stats("extract")
@@ -0,0 +1,135 @@
+import json
+import pytest
+
+from json_output import (strip_fences, strip_continuation_fences, close_truncated_json, parse_json_output,
+                         normalize_quantity, normalize_amount, normalize_document, parse_number, check_document)
+
+
+@pytest.mark.parametrize("text", [
+    '{"a": "1"}',
+    '```json\n{"a": "1"}\n```',
+    '```\n{"a": "1"}```',
+    'Here is the data:\n{"a": "1"}',
+    '{"a": "1"}\nLet me know if you need anything else.',
+    '```json\n{"a": "1"}\n```\nThe total was read from the last page.',
+    '{"a": "1"} {"b": "2"}',
+])
+def test_strip_fences(text):
+    assert strip_fences(text) == '{"a": "1"}'
+
+
+def test_strip_fences_leaves_truncated_json_for_repair():
+    assert strip_fences('```json\n{"items": [{"a": "1"}, {"a"') == '{"items": [{"a": "1"}, {"a"'
+
+
+def test_strip_continuation_fences():
+    assert strip_continuation_fences('```json\n, {"a": "2"}]}\n```') == ', {"a": "2"}]}'
+    assert strip_continuation_fences(None) == ""
+
+
+@pytest.mark.parametrize("text, expected", [
+    # Cut right after a complete row, with or without the comma that follows it
+    ('{"items": [{"a": "1"}, {"a": "2"}', {"items": [{"a": "1"}, {"a": "2"}]}),
+    ('{"items": [{"a": "1"}, {"a": "2"},', {"items": [{"a": "1"}, {"a": "2"}]}),
+    ('{"items": [{"a": "1"}, {"a": "2"}]', {"items": [{"a": "1"}, {"a": "2"}]}),
+    # Cut inside a row: the whole row is dropped
+    ('{"items": [{"a": "1"}, {"a": "2', {"items": [{"a": "1"}]}),
+    ('{"items": [{"a": "1"}, {"a": "2", "b": "3"', {"items": [{"a": "1"}]}),
+    ('{"items": [{"a": "1"}, {', {"items": [{"a": "1"}]}),
+    # Cut among the document fields
+    ('{"a": "1", "b": "2"', {"a": "1", "b": "2"}),
+    ('{"a": "1", "b": "2', {"a": "1"}),
+    ('{"a": "1", "b"', {"a": "1"}),
+    ('{"a": "1", "b": ', {"a": "1"}),
+    ('{"a": "1", "b": 12', {"a": "1"}),
+    ('{"a": "say \\"hi\\"", "b": "x', {"a": 'say "hi"'}),
+    ('["x", "y"', ["x", "y"]),
+])
+def test_close_truncated_json(text, expected):
+    assert json.loads(close_truncated_json(text)) == expected
+
+
+def test_close_truncated_json_without_a_complete_value():
+    assert close_truncated_json('{"a": "1') is None
+    assert close_truncated_json('{"a": "1"}') == '{"a": "1"}'
+
+
+def test_parse_json_output_reports_repairs():
+    assert parse_json_output('{"a": "1"}') == ({"a": "1"}, [])
+    assert parse_json_output('```json\n{"a": "1"}\n```') == ({"a": "1"}, ["fences"])
+    assert parse_json_output('{"items": [{"a": "1"}, {"a": "2"}') == ({"items": [{"a": "1"}, {"a": "2"}]}, ["truncated"])
+    with pytest.raises(json.JSONDecodeError):
+        parse_json_output('{"a": "1')
+    with pytest.raises(json.JSONDecodeError):
+        parse_json_output("no JSON here")
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("160 pcs", "160 PCS"),
+    ("1,200pcs", "1,200 PCS"),
+    ("12 pcs (12*5ctn)", "12 PCS (12*5ctn)"),
+    ("160 PCS/ 8 CTNS", "160 PCS/ 8 CTNS"),
+    ("12", "12"),
+    (124, "124"),
+    (124.0, "124"),
+    (1e16, "10000000000000000"),
+    (2.5, "2.5"),
+    (None, None),
+    ("N/A", "N/A"),
+])
+def test_normalize_quantity(value, expected):
+    assert normalize_quantity(value) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("US$ 6", "US$6.00"),
+    ("US$6.5", "US$6.50"),
+    ("6.00 USD", "US$6.00"),
+    ("USD 1,234.5", "US$1,234.50"),
+    ("SGD 6.00", "SGD 6.00"),
+    ("€6.00", "€6.00"),
+    ("$6", "$6"),
+    ("S$6.00", "S$6.00"),
+    ("6", "6"),
+    (6, "6"),
+    (6.5, "6.5"),
+    (0.00001, "0.00001"),
+    (None, None),
+])
+def test_normalize_amount(value, expected):
+    assert normalize_amount(value) == expected
+
+
+def test_normalize_document_combined_response():
+    data = {"type": "invoice", "data": {"total_quantity": "5 pcs", "items": [{"quantity": 5}]}}
+    assert normalize_document(None, data)["data"] == {"total_quantity": "5 PCS", "items": [{"quantity": "5"}]}
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("1.5 M3", (1.5, "M3")),
+    ("0.5m³", (0.5, "M3")),
+    ("160 PCS/ 8 CTNS", (160.0, "PCS")),
+    ("N/A", None),
+    ("-", None),
+    ("", None),
+])
+def test_parse_number(value, expected):
+    assert parse_number(value) == expected
+
+
+def test_parse_number_rejects_misread_numbers():
+    with pytest.raises(ValueError):
+        parse_number("US$2O.00", "amount")
+    with pytest.raises(ValueError):
+        parse_number("l2 PCS")
+
+
+def test_check_document():
+    invoice = {"vendor_name": "ACME", "address": "", "invoice_no": "1", "invoice_name": "", "date": "",
+               "total_quantity": "3 PCS", "total_amount": "US$30.00",
+               "items": [{"order": "1", "description": "", "quantity": "1 PCS", "unit_price": "", "amount": "US$10.00"},
+                         {"order": "2", "description": "", "quantity": "2 PCS", "unit_price": "", "amount": "US$20.00"}]}
+    assert check_document("invoice", invoice) == []
+    assert [kind for kind, _ in check_document("invoice", {**invoice, "total_amount": "US$3O.00"})] == ["unparsable_number"]
+    assert [kind for kind, _ in check_document("invoice", {**invoice, "total_quantity": "4 PCS"})] == ["totals_mismatch"]
+    assert [kind for kind, _ in check_document("invoice", {"invoice_no": "1"})] == ["missing_fields"]
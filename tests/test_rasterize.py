@@ -0,0 +1,81 @@
+import os
+import pytest
+from PIL import Image
+
+import app
+
+PAGES = 5
+JOBS = 4
+
+
+def fake_convert_from_path(pdf_path, dpi, first_page, last_page, output_folder=None, fmt="png", **kwargs):
+    """Stand-in for pdf2image that writes page files into output_folder like pdftocairo does"""
+    images = []
+    for page_number in range(first_page, last_page + 1):
+        image = Image.new("RGB", (60, 80), "white")
+        if output_folder:
+            path = os.path.join(output_folder, f"page-{page_number}.{fmt}")
+            image.save(path)
+            # File-backed and loaded lazily, as returned by pdf2image
+            image = Image.open(path)
+        images.append(image)
+    return images
+
+
+@pytest.fixture
+def temp_folder(tmp_path, monkeypatch):
+    folder = tmp_path / "raster"
+    folder.mkdir()
+    monkeypatch.setattr(app, "TEMP_OUTPUT_FOLDER", str(folder))
+    monkeypatch.setattr(app, "convert_from_path", fake_convert_from_path)
+    monkeypatch.setattr(app, "pdfinfo_from_path", lambda pdf_path: {"Pages": PAGES})
+    return folder
+
+
+def make_processor(raster_in_memory, monkeypatch):
+    processor = app.InvoiceProcessor(raster_window=2, raster_in_memory=raster_in_memory, use_cache=False,
+                                     use_outbox=False, use_local_classifier=False, use_text_layer=False)
+    monkeypatch.setattr(processor, "process_page", lambda page: {"type": "invoice", "data": {}})
+    return processor
+
+
+@pytest.mark.parametrize("raster_in_memory", [False, True])
+def test_no_files_left_after_jobs(temp_folder, monkeypatch, raster_in_memory):
+    processor = make_processor(raster_in_memory, monkeypatch)
+    for _ in range(JOBS):
+        results, _ = processor.process_pdf("document.pdf", send_to_api=False)
+        assert len(results) == PAGES
+    assert os.listdir(temp_folder) == []
+
+
+@pytest.mark.parametrize("raster_in_memory", [False, True])
+def test_no_files_left_when_iteration_stops_early(temp_folder, monkeypatch, raster_in_memory):
+    processor = make_processor(raster_in_memory, monkeypatch)
+    for _ in range(JOBS):
+        pages = processor.iter_pdf_pages("document.pdf")
+        next(pages)
+        pages.close()
+    assert os.listdir(temp_folder) == []
+
+
+@pytest.mark.parametrize("raster_in_memory", [False, True])
+def test_no_files_left_when_rendering_fails(temp_folder, monkeypatch, raster_in_memory):
+    def failing_convert(pdf_path, dpi, first_page, last_page, **kwargs):
+        if first_page > 2:
+            raise RuntimeError("pdftocairo failed")
+        return fake_convert_from_path(pdf_path, dpi, first_page, last_page, **kwargs)
+
+    monkeypatch.setattr(app, "convert_from_path", failing_convert)
+    processor = make_processor(raster_in_memory, monkeypatch)
+    for _ in range(JOBS):
+        with pytest.raises(RuntimeError):
+            processor.process_pdf("document.pdf", send_to_api=False)
+    assert os.listdir(temp_folder) == []
+
+
+def test_rendered_files_removed_as_soon_as_loaded(temp_folder, monkeypatch):
+    processor = make_processor(False, monkeypatch)
+    for page_number, image, _ in processor.iter_pdf_pages("document.pdf"):
+        # The scratch directory exists while pages are handed out, but holds no page files
+        assert image.size == (60, 80)
+        assert [name for _, _, names in os.walk(temp_folder) for name in names] == []
@@ -0,0 +1,51 @@
+import os
+import re
+import subprocess
+import dotenv
+
+# Load environment variables from .env file if it exists
+dotenv.load_dotenv()
+
+# Text layer configuration
+TEXT_LAYER_ENABLED = os.getenv("TEXT_LAYER_ENABLED", "True").lower() == "true"
+# Minimum number of letters and digits for a page's text layer to be used instead of an image
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "200"))
+# Seconds allowed for one pdftotext call
+TEXT_LAYER_TIMEOUT = float(os.getenv("TEXT_LAYER_TIMEOUT", "30"))
+
+
+def extract_page_texts(pdf_path, first_page, last_page):
+    """Layout-preserving text of a range of pages using poppler's pdftotext"""
+    output = subprocess.run(
+        ["pdftotext", "-layout", "-enc", "UTF-8", "-f", str(first_page), "-l", str(last_page), pdf_path, "-"],
+        capture_output=True,
+        check=True,
+        timeout=TEXT_LAYER_TIMEOUT,
+    ).stdout.decode("utf-8", errors="replace")
+
+    # pdftotext ends every page with a form feed
+    pages = output.split("\f")
+    page_count = last_page - first_page + 1
+    return (pages + [""] * page_count)[:page_count]
+
+
+def is_usable_text(text, min_chars=None):
+    """Whether a page's text layer has enough real content to extract from"""
+    min_chars = TEXT_LAYER_MIN_CHARS if min_chars is None else min_chars
+    if not text:
+        return False
+    content = sum(1 for char in text if char.isalnum())
+    # Scanned pages sometimes carry an OCR layer of mostly garbage characters
+    printable = sum(1 for char in text if char.isprintable() or char.isspace())
+    return content >= min_chars and printable >= 0.95 * len(text)
+
+
+def compact_text(text):
+    """Drop trailing whitespace, wide gaps and runs of blank lines while keeping the column layout"""
+    # Wide column gaps are shortened, which keeps columns apart at a fraction of the tokens
+    lines = [re.sub(r" {4,}", "   ", line.rstrip()) for line in text.splitlines()]
+    compacted = []
+    for line in lines:
+        if line or (compacted and compacted[-1]):
+            compacted.append(line)
+    return "\n".join(compacted).strip("\n")
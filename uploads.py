@@ -0,0 +1,66 @@
+import os
+import tempfile
+import dotenv
+
+# Load environment variables from .env file if it exists
+dotenv.load_dotenv()
+
+# Upload limits
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", "50"))  # 0 disables the limit
+MAX_PDF_PAGES = int(os.getenv("MAX_PDF_PAGES", "200"))  # 0 disables the limit
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+PDF_MAGIC = b"%PDF-"
+# Some PDF writers put a few bytes of junk before the header, which readers tolerate
+PDF_MAGIC_WINDOW = 1024
+
+
+class UploadError(Exception):
+    """Raised when an upload is rejected, with the HTTP status code to answer with"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def max_upload_bytes():
+    return int(MAX_UPLOAD_MB * 1024 * 1024)
+
+
+async def save_upload(file, directory=None):
+    """Copy an UploadFile to a new PDF file in chunks, returning its path"""
+    # The file is removed again if the upload is too large, is not a PDF or fails to copy
+    limit = max_upload_bytes()
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".pdf", dir=directory)
+    try:
+        size = 0
+        head = b""
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if limit and size > limit:
+                    raise UploadError(f"PDF is larger than the {MAX_UPLOAD_MB:g} MB upload limit", 413)
+                if len(head) < PDF_MAGIC_WINDOW:
+                    head += chunk[:PDF_MAGIC_WINDOW - len(head)]
+                f.write(chunk)
+        if PDF_MAGIC not in head:
+            raise UploadError("Uploaded file is not a PDF")
+        return path
+    except BaseException:
+        os.unlink(path)
+        raise
+
+
+def validate_pdf(path, get_page_count):
+    """Page count of a saved upload, raising UploadError if it cannot be read or has too many pages"""
+    try:
+        page_count = get_page_count(path)
+    except Exception as e:
+        raise UploadError(f"Could not read PDF: {str(e)}")
+    if page_count < 1:
+        raise UploadError("PDF has no pages")
+    if MAX_PDF_PAGES and page_count > MAX_PDF_PAGES:
+        raise UploadError(f"PDF has {page_count} pages, more than the limit of {MAX_PDF_PAGES}", 413)
+    return page_count